@@ -0,0 +1,336 @@
+import struct
+import sys
+import typing as T
+from array import array
+from collections.abc import Sequence
+
+from ast_node import AstNode, production_id, production_of
+from lexeme import Lexeme
+from visitor import walk
+
+# magic, version, n_strings, string bytes, n_productions, n_lexemes (stream + synthesized), n_stream, n_nodes
+_header = struct.Struct("<4sHxxIIIIII")
+_magic = b"AST\x00"
+_version = 3
+_alignment = 8
+
+# (typecode, what) of each column, nodes are in pre-order
+# NOTE: lexeme positions are 64 bit offsets into the input, mmap'd inputs
+# (`RegexLexer.lex_file`) can be over 4 GiB; node positions are lexeme indices
+_lexeme_columns = [("I", "name"), ("I", "value"), ("Q", "start"), ("Q", "end"), ("i", "line"), ("i", "column")]
+_node_columns = [
+    ("I", "name"),
+    ("i", "lexeme"),  # -1 for none
+    ("I", "start"),
+    ("I", "end"),
+    ("I", "child_count"),
+    ("I", "subtree_size"),  # the next sibling is at index + subtree_size
+    ("i", "production"),  # into the production table, -1 for none
+    ("b", "n_ary"),
+]
+# version -> typecodes of the (lexeme, node) start and end columns
+_positions = {1: ("I", "I"), 2: ("Q", "Q"), _version: ("Q", "I")}
+
+Buffer = T.Union[bytes, bytearray, memoryview]
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % _alignment)
+
+
+def _column_bytes(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes() + _padding(column.itemsize * len(column))
+
+
+def dumps(root: AstNode) -> bytes:
+    """Encode `root` and its lexeme stream
+
+    Layout (little endian, every section aligned to 8 bytes): header, string
+    offsets and utf-8 string data, production table (head, body string ids),
+    lexeme columns, node columns.  Strings (names and lexeme values) are stored
+    once; lexemes made up by a pass like `simplify` follow the stream.
+    """
+    strings: T.Dict[str, int] = {}
+
+    def string_id(s: str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    productions: T.Dict[T.Tuple[str, str], int] = {}
+    lexemes = list(root.lexemes)
+    lexeme_index = {id(lexeme): i for i, lexeme in enumerate(lexemes)}
+
+    nodes = [node for node, _ in walk(root)]
+    lexeme_refs = array("i", [-1]) * len(nodes)
+    production_refs = array("i", [-1]) * len(nodes)
+    for i, node in enumerate(nodes):
+        if node.lexeme is not None:
+            ref = lexeme_index.get(id(node.lexeme))
+            if ref is None:
+                ref = lexeme_index[id(node.lexeme)] = len(lexemes)
+                lexemes.append(node.lexeme)
+            lexeme_refs[i] = ref
+        if node.production >= 0:
+            production_refs[i] = productions.setdefault(production_of(node.production), len(productions))
+
+    # subtree sizes, children follow their parent in pre-order
+    child_counts = array("I", [len(node.children) for node in nodes])
+    subtree_sizes = array("I", child_counts)
+    sizes: T.List[int] = []
+    for i in range(len(nodes) - 1, -1, -1):
+        size = 1
+        for _ in range(child_counts[i]):
+            size += sizes.pop()
+        subtree_sizes[i] = size
+        sizes.append(size)
+
+    node_columns = [
+        array("I", [string_id(node.name) for node in nodes]),
+        lexeme_refs,
+        array("I", [node.start for node in nodes]),
+        array("I", [node.end for node in nodes]),
+        child_counts,
+        subtree_sizes,
+        production_refs,
+        array("b", [node.n_ary for node in nodes]),
+    ]
+    lexeme_columns = [
+        array("I", [string_id(lexeme.name) for lexeme in lexemes]),
+        array("I", [string_id(lexeme.value) for lexeme in lexemes]),
+        array("Q", [lexeme.start for lexeme in lexemes]),
+        array("Q", [lexeme.end for lexeme in lexemes]),
+        array("i", [-1 if lexeme.line is None else lexeme.line for lexeme in lexemes]),
+        array("i", [-1 if lexeme.column is None else lexeme.column for lexeme in lexemes]),
+    ]
+
+    production_column = array("I", [string_id(s) for production in productions for s in production])
+    encoded = [s.encode() for s in strings]
+    offsets = array("I", [0])
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    string_data = b"".join(encoded)
+
+    return b"".join(
+        [
+            _header.pack(_magic, _version, len(strings), len(string_data), len(productions), len(lexemes), len(root.lexemes), len(nodes)),
+            _padding(_header.size),
+            _column_bytes(offsets),
+            string_data,
+            _padding(len(string_data)),
+            _column_bytes(production_column),
+            *[_column_bytes(column) for column in lexeme_columns],
+            *[_column_bytes(column) for column in node_columns],
+        ]
+    )
+
+
+class _LazyLexemes(Sequence):
+    """The lexeme stream, a `Lexeme` is only built when it is looked at"""
+
+    def __init__(self, view: "TreeView"):
+        self.view = view
+
+    def __len__(self) -> int:
+        return self.view.n_stream
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.view.lexeme(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.view.lexeme(index)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+
+class _LazyChildren(Sequence):
+    """Children of a node, built on first access (the count is known up front)"""
+
+    def __init__(self, view: "TreeView", index: int):
+        self.view = view
+        self.index = index
+        self._children: T.Optional[T.List[AstNode]] = None
+
+    def materialize(self) -> T.List[AstNode]:
+        if self._children is None:
+            self._children = [self.view.node(i) for i in self.view.child_indices(self.index)]
+        return self._children
+
+    def __len__(self) -> int:
+        return self.view.child_count[self.index]
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Sequence) and self.materialize() == list(other)
+
+
+class TreeView:
+    """Read-only view of an encoded tree, the columns are memoryviews of the buffer
+
+    Nothing is copied (bar the string table) until nodes and lexemes are asked
+    for: `root` builds nodes as the tree is walked, `materialize` the whole tree.
+    """
+
+    def __init__(self, data: Buffer):
+        buffer = memoryview(data)
+        magic, version, n_strings, string_bytes, n_productions, n_lexemes, n_stream, n_nodes = _header.unpack_from(buffer)
+        if magic != _magic or version not in _positions:
+            raise ValueError(f"[TreeView] not an encoded tree (version 1 to {_version})")
+        lexeme_position, node_position = _positions[version]
+        self.n_stream = n_stream
+        self.n_nodes = n_nodes
+        offset = _header.size + len(_padding(_header.size))
+
+        def take(typecode: str, count: int) -> T.Any:
+            nonlocal offset
+            size = struct.calcsize(typecode) * count
+            column: T.Any = buffer[offset : offset + size].cast(typecode)
+            if sys.byteorder == "big":
+                column = array(typecode, column)
+                column.byteswap()
+            offset += size + len(_padding(size))
+            return column
+
+        string_offsets = take("I", n_strings + 1)
+        string_data = bytes(buffer[offset : offset + string_bytes])
+        offset += string_bytes + len(_padding(string_bytes))
+        self.strings = [string_data[string_offsets[i] : string_offsets[i + 1]].decode() for i in range(n_strings)]
+        production_column = take("I", 2 * n_productions)
+        self.productions = [
+            production_id(self.strings[production_column[2 * i]], self.strings[production_column[2 * i + 1]])
+            for i in range(n_productions)
+        ]
+        (
+            self.lexeme_name,
+            self.lexeme_value,
+            self.lexeme_start,
+            self.lexeme_end,
+            self.lexeme_line,
+            self.lexeme_column,
+        ) = [take(lexeme_position if what in ("start", "end") else typecode, n_lexemes) for typecode, what in _lexeme_columns]
+        (
+            self.name,
+            self.lexeme_ref,
+            self.start,
+            self.end,
+            self.child_count,
+            self.subtree_size,
+            self.production,
+            self.n_ary,
+        ) = [take(node_position if what in ("start", "end") else typecode, n_nodes) for typecode, what in _node_columns]
+        self._lexemes: T.List[T.Optional[Lexeme]] = [None] * n_lexemes
+        self.lexemes = _LazyLexemes(self)
+
+    def lexeme(self, i: int) -> Lexeme:
+        lexeme = self._lexemes[i]
+        if lexeme is None:
+            line, column = self.lexeme_line[i], self.lexeme_column[i]
+            lexeme = self._lexemes[i] = Lexeme(
+                self.strings[self.lexeme_name[i]],
+                self.strings[self.lexeme_value[i]],
+                self.lexeme_start[i],
+                self.lexeme_end[i],
+                None if line < 0 else line,
+                None if column < 0 else column,
+            )
+        return lexeme
+
+    def child_indices(self, i: int) -> T.Iterator[int]:
+        child = i + 1
+        for _ in range(self.child_count[i]):
+            yield child
+            child += self.subtree_size[child]
+
+    def node(self, i: int) -> AstNode:
+        """Node `i` (in pre-order), its children are built when first used"""
+        lexeme_ref = self.lexeme_ref[i]
+        production = self.production[i]
+        return AstNode(
+            self.strings[self.name[i]],
+            T.cast(T.List[AstNode], _LazyChildren(self, i)),
+            None if lexeme_ref < 0 else self.lexeme(lexeme_ref),
+            self.start[i],
+            self.end[i],
+            T.cast(T.List[Lexeme], self.lexemes),
+            n_ary=bool(self.n_ary[i]),
+            production=-1 if production < 0 else self.productions[production],
+        )
+
+    @property
+    def root(self) -> AstNode:
+        return self.node(0)
+
+    def materialize(self) -> AstNode:
+        """The whole tree as plain `AstNode`s, sharing a plain lexeme list"""
+        strings, productions = self.strings, self.productions
+        names, lexeme_refs, starts, ends = self.name, self.lexeme_ref, self.start, self.end
+        child_counts, production_refs, n_arys = self.child_count, self.production, self.n_ary
+        stream = [self.lexeme(i) for i in range(self.n_stream)]
+        built: T.List[AstNode] = []
+        for i in range(self.n_nodes - 1, -1, -1):
+            child_count = child_counts[i]
+            children = built[len(built) - child_count :][::-1] if child_count else []
+            if child_count:
+                del built[len(built) - child_count :]
+            lexeme_ref = lexeme_refs[i]
+            production = production_refs[i]
+            built.append(
+                AstNode(
+                    strings[names[i]],
+                    children,
+                    None if lexeme_ref < 0 else self.lexeme(lexeme_ref),
+                    starts[i],
+                    ends[i],
+                    stream,
+                    n_ary=bool(n_arys[i]),
+                    production=-1 if production < 0 else productions[production],
+                )
+            )
+        return built[0]
+
+
+def loads(data: Buffer, lazy: bool = False) -> AstNode:
+    view = TreeView(data)
+    return view.root if lazy else view.materialize()
+
+
+if __name__ == "__main__":
+    import pickle
+    import timeit
+
+    with open("_saved_stats.pickle", "rb") as f:
+        saved_stats = pickle.load(f)
+    trees = [stats.result for stats in saved_stats if stats.result is not None]
+
+    from grammar_registry import registry
+    from grammars import expression_grammar
+    from workload_generator import generate_sentence
+
+    sys.setrecursionlimit(1_000_000)
+    text = generate_sentence(expression_grammar, 2_000, seed=1)
+    lexemes = list(registry.lexer(expression_grammar)(text))
+    trees.append(registry.parser(expression_grammar, "memoized").parse(lexemes, expression_grammar.start_symbol, 0))
+
+    for name, tree in (("_saved_stats.pickle trees", trees[:-1]), (f"generated, {len(lexemes)} lexemes", trees[-1:])):
+        pickled = [pickle.dumps(t, protocol=pickle.HIGHEST_PROTOCOL) for t in tree]
+        encoded = [dumps(t) for t in tree]
+        assert all(loads(e) == t for e, t in zip(encoded, tree))
+        timings = {
+            "pickle dump": timeit.timeit(lambda: [pickle.dumps(t, protocol=pickle.HIGHEST_PROTOCOL) for t in tree], number=3),
+            "dumps": timeit.timeit(lambda: [dumps(t) for t in tree], number=3),
+            "pickle load": timeit.timeit(lambda: [pickle.loads(p) for p in pickled], number=3),
+            "loads": timeit.timeit(lambda: [loads(e) for e in encoded], number=3),
+            "loads lazy (root)": timeit.timeit(lambda: [loads(e, lazy=True) for e in encoded], number=3),
+        }
+        print(f"{name}: pickle {sum(map(len, pickled))} bytes, encoded {sum(map(len, encoded))} bytes")
+        for what, seconds in timings.items():
+            print(f"  {what:18} {seconds / 3:.6f}s")
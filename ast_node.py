@@ -1,9 +1,34 @@
+import threading
 import typing as T
 from dataclasses import dataclass
 
 from lexeme import Lexeme
 
 
+# (head, body) -> id, interned once per process so ids can be compared (and
+# dispatched on) without looking at strings
+_production_ids: T.Dict[T.Tuple[str, str], int] = {}
+_productions: T.List[T.Tuple[str, str]] = []
+_intern_lock = threading.Lock()
+
+
+def production_id(head: str, body: str) -> int:
+    key = (head, body)
+    production = _production_ids.get(key)
+    if production is not None:
+        return production
+    # NOTE: only new productions take the lock, so two threads can't give one key two ids
+    with _intern_lock:
+        if key not in _production_ids:
+            _productions.append(key)
+            _production_ids[key] = len(_productions) - 1
+        return _production_ids[key]
+
+
+def production_of(production: int) -> T.Tuple[str, str]:
+    return _productions[production]
+
+
 @dataclass
 class AstNode:
     name: str
@@ -13,24 +38,25 @@ class AstNode:
     start: int
     end: int
     lexemes: T.List[Lexeme]
+    # children are `operand (op operand)*`, evaluated left to right (see simplify)
+    n_ary: bool = False
+    # id of the production that built the node, -1 for leaves, `n_ary` nodes and nodes built by hand
+    production: int = -1
 
     @property
     def value(self) -> str:
         return " ".join([l.value for l in self.lexemes[self.start : self.end]])
 
     def matches_production(self, head: str, body: str) -> bool:
+        if self.production >= 0:
+            return self.production == _production_ids.get((head, body))
         split_body = body.split()
         return (
             head == self.name
             and len(self.children) == len(split_body)
-            and all(
-                [
-                    child.name == symbol
-                    for child, symbol in zip(self.children, body.split())
-                ]
-            )
+            and all(child.name == symbol for child, symbol in zip(self.children, split_body))
         )
-    
+
     def matches_productions(self, productions: T.List[T.Tuple[str,str]]) -> bool:
         return any(self.matches_production(head, body) for head,body in productions)
 
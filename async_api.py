@@ -0,0 +1,156 @@
+import asyncio
+import time
+import typing as T
+from concurrent.futures import Executor
+from functools import partial
+
+from ast_node import AstNode
+from fp_lang import evaluate_fp_program
+from grammar import Grammar
+from grammar_registry import registry
+from grammars import fp_language_grammar
+from lexeme import Lexeme
+
+Result = T.TypeVar("Result")
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint in the worker, once its request is abandoned"""
+
+
+class DeadlineExceeded(Cancelled):
+    """The worker noticed the deadline first, the caller sees an `asyncio.TimeoutError`"""
+
+
+class StepBudget:
+    """Checkpoint for the parser / evaluator, raises `Cancelled` when it's time to stop
+
+    The clock is only read every `check_every` steps, to keep the checkpoint cheap.
+    """
+
+    def __init__(self, deadline: T.Optional[float] = None, max_steps: T.Optional[int] = None, check_every: int = 256):
+        self.deadline = deadline
+        self.max_steps = max_steps
+        self.check_every = check_every
+        self.steps = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __call__(self):
+        self.steps += 1
+        if self.cancelled:
+            raise Cancelled("cancelled")
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise Cancelled(f"step budget of {self.max_steps} exhausted")
+        if self.deadline is not None and self.steps % self.check_every == 0 and time.monotonic() > self.deadline:
+            raise DeadlineExceeded("deadline exceeded")
+
+
+async def _run(
+    fn: T.Callable[[StepBudget], Result],
+    timeout: T.Optional[float],
+    max_steps: T.Optional[int],
+    executor: T.Optional[Executor],
+) -> Result:
+    """Run `fn` on `executor` (the loop's default thread pool if None)
+
+    The event loop never blocks: on timeout or cancellation the budget is cancelled,
+    so the worker stops at its next checkpoint instead of running on in the pool.
+    `fn` has to be picklable for a process pool (a module level function or a
+    `partial` of one), and gets a copy of the budget: the deadline and step budget
+    still stop it, but cancelling only abandons the await.
+    """
+    loop = asyncio.get_running_loop()
+    budget = StepBudget(None if timeout is None else time.monotonic() + timeout, max_steps)
+    future = loop.run_in_executor(executor, fn, budget)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except DeadlineExceeded as e:
+        raise asyncio.TimeoutError() from e
+    except Cancelled:
+        raise
+    except BaseException:
+        budget.cancel()
+        raise
+
+
+def _lex_and_parse(text: str, grammar: Grammar, parser_type: T.Literal["normal", "memoized"], budget: StepBudget) -> AstNode:
+    lexemes: T.List[Lexeme] = []
+    for lexeme in registry.lexer(grammar)(text):
+        budget()
+        lexemes.append(lexeme)
+    parser = registry.parser(grammar, parser_type)
+    return parser.parse_with_context(lexemes, grammar.start_symbol, 0, checkpoint=budget)[0]
+
+
+def _evaluate(program: T.Union[str, AstNode], budget: StepBudget) -> T.Any:
+    if isinstance(program, str):
+        root_node = _lex_and_parse(program, fp_language_grammar, "memoized", budget)
+    else:
+        root_node = program
+    return evaluate_fp_program(root_node, checkpoint=budget)
+
+
+async def parse(
+    text: str,
+    grammar: Grammar = fp_language_grammar,
+    parser_type: T.Literal["normal", "memoized"] = "memoized",
+    timeout: T.Optional[float] = None,
+    max_steps: T.Optional[int] = None,
+    executor: T.Optional[Executor] = None,
+) -> AstNode:
+    """Lex and parse `text` off the event loop
+
+    Raises `asyncio.TimeoutError` after `timeout` seconds, `Cancelled` after
+    `max_steps` lexemes + parse calls.
+    """
+    return await _run(partial(_lex_and_parse, text, grammar, parser_type), timeout, max_steps, executor)
+
+
+async def evaluate(
+    program: T.Union[str, AstNode],
+    timeout: T.Optional[float] = None,
+    max_steps: T.Optional[int] = None,
+    executor: T.Optional[Executor] = None,
+) -> T.Any:
+    """Evaluate an fpLang program (source or parsed), parsing it first if needed
+
+    The timeout and step budget cover parsing and evaluation together.
+    """
+    return await _run(partial(_evaluate, program), timeout, max_steps, executor)
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ProcessPoolExecutor
+
+    from grammars import bad_expression_grammar
+
+    async def main():
+        async def timed(name: str, awaitable: T.Awaitable[T.Any]):
+            start = time.monotonic()
+            try:
+                result = await awaitable
+            except (asyncio.TimeoutError, Cancelled) as e:
+                result = f"{type(e).__name__} {e}"
+            print(f"[{time.monotonic() - start:7.3f}s] {name}: {result}")
+
+        await asyncio.gather(
+            timed(
+                "bad_expression_grammar ugly_20",
+                parse(bad_expression_grammar.examples["ugly_20"], bad_expression_grammar, "normal", timeout=1),
+            ),
+            timed("step budget", parse(bad_expression_grammar.examples["ugly_20"], bad_expression_grammar, "normal", max_steps=10_000)),
+            *[timed(name, evaluate(text, timeout=5)) for name, text in fp_language_grammar.examples.items()],
+        )
+        with ProcessPoolExecutor(2) as pool:
+            await asyncio.gather(
+                timed(
+                    "process pool ugly_20",
+                    parse(bad_expression_grammar.examples["ugly_20"], bad_expression_grammar, "normal", timeout=1, executor=pool),
+                ),
+                timed("process pool statements", evaluate(fp_language_grammar.examples["statements"], timeout=5, executor=pool)),
+            )
+
+    asyncio.run(main())
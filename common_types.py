@@ -5,3 +5,5 @@ NamedTerminal = T.Tuple[str, str]
 THead = str
 TBody = str
 TProduction = T.Tuple[THead, TBody]
+# head -> [(body, ((symbol, is_lexeme_name), ...)), ...], in grammar order
+TParseTable = T.Dict[THead, T.List[T.Tuple[TBody, T.Tuple[T.Tuple[str, bool], ...]]]]
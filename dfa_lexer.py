@@ -0,0 +1,424 @@
+import typing as T
+
+from lexer_exception import LexerException
+from regex_lexer import RegexLexer
+
+# input symbols are latin-1 code points (or bytes), every other character is this one
+_other = 256
+_alphabet = range(_other + 1)
+
+TCharSet = T.FrozenSet[int]
+
+
+def _chars(s: str) -> TCharSet:
+    return frozenset(map(ord, s))
+
+
+_digits = _chars("0123456789")
+_word = _digits | _chars("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_")
+_space = _chars(" \t\n\r\f\v")
+_class_escapes = {
+    "d": _digits,
+    "w": _word,
+    "s": _space,
+    "D": frozenset(_alphabet) - _digits,
+    "W": frozenset(_alphabet) - _word,
+    "S": frozenset(_alphabet) - _space,
+}
+_char_escapes = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v"}
+
+
+class UnsupportedPattern(ValueError):
+    """The pattern uses `re` features that aren't regular (or aren't implemented)"""
+
+
+class _Nfa:
+    """Thompson construction, states are indices into `epsilons` / `edges`"""
+
+    def __init__(self):
+        self.epsilons: T.List[T.List[int]] = []
+        self.edges: T.List[T.List[T.Tuple[TCharSet, int]]] = []
+
+    def state(self) -> int:
+        self.epsilons.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def closure(self, states: T.Iterable[int]) -> T.FrozenSet[int]:
+        result = set(states)
+        stack = list(result)
+        while stack:
+            for target in self.epsilons[stack.pop()]:
+                if target not in result:
+                    result.add(target)
+                    stack.append(target)
+        return frozenset(result)
+
+
+class _PatternParser:
+    """Recursive descent over the regex subset used by the grammars
+
+    Literals, escapes, `.`, `[...]` classes, groups, `|`, `*`, `+` and `?`.
+    Returns (start, end) fragments of the NFA.
+    """
+
+    def __init__(self, nfa: _Nfa, pattern: str):
+        self.nfa = nfa
+        self.pattern = pattern
+        self.i = 0
+
+    def peek(self) -> T.Optional[str]:
+        return self.pattern[self.i] if self.i < len(self.pattern) else None
+
+    def take(self) -> str:
+        if self.i >= len(self.pattern):
+            raise UnsupportedPattern(f"unexpected end of pattern: {self.pattern!r}")
+        self.i += 1
+        return self.pattern[self.i - 1]
+
+    def parse(self) -> T.Tuple[int, int]:
+        fragment = self.alternation()
+        if self.i != len(self.pattern):
+            raise UnsupportedPattern(f"unexpected {self.peek()!r} at {self.i} in {self.pattern!r}")
+        return fragment
+
+    def alternation(self) -> T.Tuple[int, int]:
+        fragments = [self.sequence()]
+        while self.peek() == "|":
+            self.take()
+            fragments.append(self.sequence())
+        if len(fragments) == 1:
+            return fragments[0]
+        start, end = self.nfa.state(), self.nfa.state()
+        for _start, _end in fragments:
+            self.nfa.epsilons[start].append(_start)
+            self.nfa.epsilons[_end].append(end)
+        return start, end
+
+    def sequence(self) -> T.Tuple[int, int]:
+        start = end = self.nfa.state()
+        while self.peek() not in (None, "|", ")"):
+            _start, _end = self.repetition()
+            self.nfa.epsilons[end].append(_start)
+            end = _end
+        return start, end
+
+    def repetition(self) -> T.Tuple[int, int]:
+        start, end = self.atom()
+        while self.peek() in ("*", "+", "?"):
+            op = self.take()
+            if self.peek() in ("?", "+"):
+                raise UnsupportedPattern(f"lazy / possessive quantifiers in {self.pattern!r}")
+            _start, _end = self.nfa.state(), self.nfa.state()
+            self.nfa.epsilons[_start].append(start)
+            self.nfa.epsilons[end].append(_end)
+            if op in ("*", "?"):
+                self.nfa.epsilons[_start].append(_end)
+            if op in ("*", "+"):
+                self.nfa.epsilons[end].append(start)
+            start, end = _start, _end
+        return start, end
+
+    def atom(self) -> T.Tuple[int, int]:
+        c = self.take()
+        if c == "(":
+            if self.peek() == "?":
+                self.take()
+                if self.take() != ":":
+                    raise UnsupportedPattern(f"only (?:...) groups are supported: {self.pattern!r}")
+            fragment = self.alternation()
+            if self.take() != ")":
+                raise UnsupportedPattern(f"unbalanced group in {self.pattern!r}")
+            return fragment
+        elif c == "[":
+            charset = self.char_class()
+        elif c == "\\":
+            charset = self.escape()
+        elif c == ".":
+            charset = frozenset(_alphabet) - _chars("\n")
+        elif c in "^${})]*+?":
+            raise UnsupportedPattern(f"{c!r} in {self.pattern!r}")
+        else:
+            charset = _chars(c)
+        start, end = self.nfa.state(), self.nfa.state()
+        self.nfa.edges[start].append((charset, end))
+        return start, end
+
+    def escape(self) -> TCharSet:
+        c = self.take()
+        if c in _class_escapes:
+            return _class_escapes[c]
+        elif c in _char_escapes:
+            return _chars(_char_escapes[c])
+        elif c.isalnum():
+            raise UnsupportedPattern(f"\\{c} in {self.pattern!r}")
+        return _chars(c)
+
+    def char_class(self) -> TCharSet:
+        negated = self.peek() == "^"
+        if negated:
+            self.take()
+        members: T.Set[int] = set()
+        first = True
+        while first or self.peek() != "]":
+            first = False
+            c = self.take()
+            if c == "\\":
+                low = self.escape()
+            else:
+                low = _chars(c)
+            if self.peek() == "-" and self.pattern[self.i + 1 : self.i + 2] not in ("]", ""):
+                self.take()
+                high = self.take()
+                if len(low) != 1 or high == "\\":
+                    raise UnsupportedPattern(f"range in {self.pattern!r}")
+                members |= set(range(min(low), ord(high) + 1))
+            else:
+                members |= low
+        self.take()
+        return frozenset(_alphabet) - frozenset(members) if negated else frozenset(members)
+
+
+class Dfa:
+    """Minimized DFA recognizing every terminal at once
+
+    `delta[state * n_classes + symbol_class]` is the next state, -1 when there is
+    none.  `byte_classes` maps byte / latin-1 code `b` to its class `byte_classes[b]`,
+    for `bytes.translate` (None if there are too many classes for a byte each).  `accepts[state]` are the indices of the terminals matched on reaching
+    `state`, `first[state]` the smallest of them (the terminal listed first).
+    """
+
+    start: int
+    n_classes: int
+    # input symbol (an int from bytes, or a 1 character str) -> symbol class
+    classes: T.Dict[T.Union[int, str], int]
+    other_class: int
+    byte_classes: T.Optional[bytes]
+    delta: T.List[int]
+    accepts: T.List[T.FrozenSet[int]]
+    first: T.List[int]
+
+    def __init__(self, patterns: T.List[str]):
+        nfa = _Nfa()
+        nfa_start = nfa.state()
+        accepting: T.Dict[int, int] = {}
+        for index, pattern in enumerate(patterns):
+            start, end = _PatternParser(nfa, pattern).parse()
+            nfa.epsilons[nfa_start].append(start)
+            accepting[end] = index
+
+        # symbols every char set treats alike share a class
+        charsets = sorted({charset for edges in nfa.edges for charset, _ in edges}, key=sorted)
+        signatures: T.Dict[T.Tuple[bool, ...], int] = {}
+        symbol_class = [signatures.setdefault(tuple(s in charset for charset in charsets), len(signatures)) for s in _alphabet]
+        representatives = [symbol_class.index(c) for c in range(len(signatures))]
+        self.n_classes = len(signatures)
+
+        # subset construction
+        start_set = nfa.closure([nfa_start])
+        subsets = {start_set: 0}
+        pending = [start_set]
+        transitions: T.List[T.List[int]] = []
+        subset_accepts: T.List[T.FrozenSet[int]] = []
+        while pending:
+            subset = pending.pop(0)
+            row = []
+            for representative in representatives:
+                targets = [target for state in subset for charset, target in nfa.edges[state] if representative in charset]
+                if not targets:
+                    row.append(-1)
+                    continue
+                target_set = nfa.closure(targets)
+                if target_set not in subsets:
+                    subsets[target_set] = len(subsets)
+                    pending.append(target_set)
+                row.append(subsets[target_set])
+            transitions.append(row)
+            subset_accepts.append(frozenset(accepting[state] for state in subset if state in accepting))
+
+        # Moore's partition refinement, starting from states accepting the same terminals
+        accept_blocks: T.Dict[T.FrozenSet[int], int] = {}
+        blocks = [accept_blocks.setdefault(accepts, len(accept_blocks)) for accepts in subset_accepts]
+        while True:
+            signatures_ = [(blocks[s], *(-1 if t < 0 else blocks[t] for t in transitions[s])) for s in range(len(transitions))]
+            numbering: T.Dict[T.Tuple[int, ...], int] = {}
+            refined = [numbering.setdefault(signature, len(numbering)) for signature in signatures_]
+            if len(numbering) == len(set(blocks)):
+                break
+            blocks = refined
+        blocks = refined
+
+        n_states = len(set(blocks))
+        self.start = blocks[0]
+        self.delta = [-1] * (n_states * self.n_classes)
+        self.accepts = [frozenset()] * n_states
+        for s, row in enumerate(transitions):
+            for c, t in enumerate(row):
+                self.delta[blocks[s] * self.n_classes + c] = -1 if t < 0 else blocks[t]
+            self.accepts[blocks[s]] = subset_accepts[s]
+        self.first = [min(accepts, default=len(patterns)) for accepts in self.accepts]
+        self.classes = {}
+        for s in range(_other):
+            self.classes[s] = self.classes[chr(s)] = symbol_class[s]
+        self.other_class = symbol_class[_other]
+        self.byte_classes = bytes(symbol_class[:_other]) if self.n_classes <= 256 else None
+
+    @property
+    def n_states(self) -> int:
+        return len(self.accepts)
+
+    def tables(self) -> T.Dict[str, T.Any]:
+        """Every table, plain ints, lists, dicts and frozensets (see `GrammarRegistry.save`)"""
+        return {name: getattr(self, name) for name in _dfa_tables}
+
+    @classmethod
+    def from_tables(cls, tables: T.Mapping[str, T.Any]) -> "Dfa":
+        """A `Dfa` from the `tables` of one built before, without redoing the construction"""
+        dfa = cls.__new__(cls)
+        for name in _dfa_tables:
+            setattr(dfa, name, tables[name])
+        return dfa
+
+
+_dfa_tables = ["start", "n_classes", "classes", "other_class", "byte_classes", "delta", "accepts", "first"]
+
+
+class DfaLexer(RegexLexer):
+    """`RegexLexer` running one table driven DFA instead of a regex per terminal
+
+    The terminal listed first wins, as with `RegexLexer`, and it matches as much
+    as it can (with `longest_match`, the longest token wins).  NOTE: `re`
+    alternation is first-match within a terminal too, so a terminal like `<|<=`
+    matches `<=` here and `<` there.  Chars past latin-1 are
+    all one symbol, so `\\w`, `\\s`, `\\d` are ascii only.
+    """
+
+    dfa: Dfa
+    names: T.List[str]
+    # str.translate table, latin-1 code point -> class id (a 1 char str), anything else -> `other_class`
+    char_classes: T.Dict[int, str]
+    # states are numbered `state * n_classes`, to save a multiplication per symbol:
+    # (next state by `state + symbol_class`, first terminal and accepts by `state`, start state)
+    steps: T.Tuple[T.List[int], T.List[int], T.List[T.FrozenSet[int]], int]
+
+    def __init__(self, name_pattern_pairs: T.List[T.Tuple[str, str]], lookahead: int = 1024, dfa: T.Optional[Dfa] = None, **kwargs):
+        """`dfa` is one built before for the same terminals (e.g. by `Dfa.from_tables`)"""
+        super().__init__(name_pattern_pairs, lookahead, **kwargs)
+        self.names = [name for name, _ in self.terminals]
+        self.dfa = Dfa([pattern for _, pattern in self.terminals]) if dfa is None else dfa
+        self.char_classes = _CharClasses({s: chr(c) for s, c in enumerate(self.dfa.byte_classes or b"")})
+        self.char_classes.other = chr(self.dfa.other_class)
+        n_classes = self.dfa.n_classes
+        first = [len(self.names)] * len(self.dfa.delta)
+        accepts: T.List[T.FrozenSet[int]] = [frozenset()] * len(self.dfa.delta)
+        for state in range(self.dfa.n_states):
+            first[state * n_classes] = self.dfa.first[state]
+            accepts[state * n_classes] = self.dfa.accepts[state]
+        next_states = [-1 if state < 0 else state * n_classes for state in self.dfa.delta]
+        self.steps = (next_states, first, accepts, self.dfa.start * n_classes)
+
+    def prepare(self, buffer: T.Any) -> T.Optional[bytes]:
+        """The class id of every input symbol, translated in one pass
+
+        NOTE: an mmap'd file isn't translated (that would copy all of it), its
+        symbols are looked up one at a time.
+        """
+        if self.dfa.byte_classes is None:
+            return None
+        elif isinstance(buffer, str):
+            return buffer.translate(self.char_classes).encode("latin-1")
+        elif isinstance(buffer, (bytes, bytearray)):
+            return buffer.translate(self.dfa.byte_classes)
+        return None
+
+    def match(self, buffer: T.Any, i: int, prepared: T.Any = None) -> T.Optional[T.Tuple[str, int]]:
+        next_states, first, accepts, state = self.steps
+        longest_match = self.longest_match
+        best = len(self.names)
+        end = -1
+        if prepared is not None:
+            for j in range(i, len(prepared)):
+                state = next_states[state + prepared[j]]
+                if state < 0:
+                    break
+                if first[state] < best or (longest_match and accepts[state]):
+                    best = first[state]
+                    end = j + 1
+                elif best in accepts[state]:
+                    end = j + 1
+        else:
+            classes, other_class = self.dfa.classes, self.dfa.other_class
+            for j in range(i, len(buffer)):
+                state = next_states[state + classes.get(buffer[j], other_class)]
+                if state < 0:
+                    break
+                if first[state] < best or (longest_match and accepts[state]):
+                    best = first[state]
+                    end = j + 1
+                elif best in accepts[state]:
+                    end = j + 1
+        if end < 0:
+            return None
+        return self.names[best], end
+
+
+class _CharClasses(dict):
+    """`str.translate` leaves code points missing from the table alone, these are `other`"""
+
+    other: str
+
+    def __missing__(self, key: int) -> str:
+        return self.other
+
+
+def equivalence_mismatches(
+    terminals: T.List[T.Tuple[str, str]], texts: T.Iterable[str], **kwargs
+) -> T.List[T.Tuple[str, T.List[T.Tuple[str, str]], T.List[T.Tuple[str, str]]]]:
+    """(text, regex lexemes, dfa lexemes) for every text the two backends lex differently"""
+    regex_lexer = RegexLexer(terminals, **kwargs)
+    dfa_lexer = DfaLexer(terminals, **kwargs)
+
+    def lex(lexer: RegexLexer, text: str) -> T.List[T.Tuple[str, str]]:
+        """(name, value) pairs, up to a `LexerException` (both must fail at the same place)"""
+        pairs = []
+        try:
+            for lexeme in lexer(text):
+                pairs.append((lexeme.name, lexeme.value))
+        except LexerException as e:
+            pairs.append(("LexerException", str(e)))
+        return pairs
+
+    mismatches = []
+    for text in texts:
+        by_regex = lex(regex_lexer, text)
+        by_dfa = lex(dfa_lexer, text)
+        if by_regex != by_dfa:
+            mismatches.append((text, by_regex, by_dfa))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import timeit
+    from grammars import bad_expression_grammar, expression_grammar, fp_language_grammar
+    from workload_generator import generate_sentence
+
+    # the backends must agree, floats under longest match included (`1.5` is one float, not `1.` `5`)
+    for grammar in (expression_grammar, fp_language_grammar):
+        texts = [generate_sentence(grammar, target_tokens=50, seed=seed) for seed in range(200)]
+        texts += ["1.5", "0.25 * 3.", ".5 + 10.75", "(x - 2.5) * 0.0"]
+        for longest_match in (False, True):
+            mismatches = equivalence_mismatches(grammar.terminals, texts, longest_match=longest_match, keywords=grammar.keywords)
+            assert not mismatches, f"{grammar.name} longest_match={longest_match}: {mismatches[0]}"
+
+    for grammar in (expression_grammar, bad_expression_grammar, fp_language_grammar):
+        options = dict(longest_match=grammar.longest_match, keywords=grammar.keywords)
+        regex_lexer = RegexLexer(grammar.terminals, **options)
+        dfa_lexer = DfaLexer(grammar.terminals, **options)
+        text = " ".join(grammar.examples.values()) * 200
+        same = [(l.name, l.value) for l in regex_lexer(text)] == [(l.name, l.value) for l in dfa_lexer(text)]
+        lexeme_count = sum(1 for _ in regex_lexer(text))
+        seconds = [min(timeit.repeat(lambda: sum(1 for _ in lexer(text)), number=1, repeat=5)) for lexer in (regex_lexer, dfa_lexer)]
+        print(
+            f"{grammar.name:20} {dfa_lexer.dfa.n_states:3} states {dfa_lexer.dfa.n_classes:3} classes  same lexemes: {same}  "
+            + "  ".join(f"{name} {lexeme_count / s:10.0f} lexemes/s" for name, s in zip(("re", "dfa"), seconds))
+        )
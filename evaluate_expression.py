@@ -5,6 +5,7 @@ from lexeme import Lexeme
 from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
 from regex_lexer import RegexLexer
 from util import print_node
+from visitor import Dispatcher, fold
 
 import logging
 import operator
@@ -24,52 +25,82 @@ OperandList = T.List[T.Tuple[AstNode, T.Optional[str]]]
 
 def get_operand_sequence(node: AstNode) -> OperandList:
     """Get the longest contiguous sequence of operands of operators of the same precedence"""
-    if node.matches_productions(
-        [("MulExpr", "Factor mul_op MulExpr"), ("AddExpr", "MulExpr add_op AddExpr")],
-    ):
-        operand = (node.children[0], T.cast(Lexeme, node.children[1].lexeme).value)
-        return [operand, *get_operand_sequence(node.children[2])]
-    elif node.matches_productions([("MulExpr", "Factor"), ("AddExpr", "MulExpr")]):
-        return [(node, None)]
-    else:
-        return []
+    if node.n_ary:
+        ops = [T.cast(Lexeme, op.lexeme).value for op in node.children[1::2]]
+        return list(zip(node.children[0::2], [*ops, None]))
+    operand_sequence: OperandList = []
+    name = node.name
+    while node.name == name and len(node.children) == 3 and node.children[1].lexeme is not None and not node.n_ary:
+        operand_sequence.append((node.children[0], T.cast(Lexeme, node.children[1].lexeme).value))
+        node = node.children[2]
+    operand_sequence.append((node, None))
+    return operand_sequence
 
 
 def _default_handler(node: AstNode):
     raise Exception(f"[evaluate_expression] failed to handle node: {node}")
 
 
-def evaluate_expression(
-    node: AstNode,
-    node_handler: T.Callable[[AstNode], T.Union[int, float]] = _default_handler
-) -> T.Union[int, float]:
+TNodeHandler = T.Callable[[AstNode], T.Union[int, float]]
+
+
+def _skip_units(node: AstNode) -> AstNode:
+    """Unit productions pass their child's value on, so they needn't be visited"""
+    while len(node.children) == 1:
+        node = node.children[0]
+    return node
+
+
+def _chain_operands(node: AstNode) -> T.Sequence[AstNode]:
+    if len(node.children) == 1:
+        return [_skip_units(node)]
+    return [_skip_units(operand) for operand, _ in get_operand_sequence(node)]
+
+
+def _combine_chain(node: AstNode, values: T.List[T.Union[int, float]], node_handler: TNodeHandler) -> T.Union[int, float]:
+    # we handle left-associativity here...
     if len(node.children) == 1:
-        return evaluate_expression(node.children[0], node_handler=node_handler)
-    elif node.name in ("AddExpr", "MulExpr"):
-        # we handle left-associativity here...
-        operand_sequence = get_operand_sequence(node)
-        acc = evaluate_expression(operand_sequence[0][0], node_handler=node_handler)
-        op = operand_sequence[0][1]
-        for operand, next_op in operand_sequence[1:]:
-            if op is None:
-                raise RuntimeError(f"No op provided for {operand.value} at {node.value}")
-            rhs = evaluate_expression(operand, node_handler=node_handler)
-            acc = _op_table[op](acc, rhs)
-            op = next_op
-        return acc
-    elif node.matches_production("Factor", "lbrace AddExpr rbrace"):
-        return evaluate_expression(node.children[1], node_handler=node_handler)
-    elif node.lexeme is not None:
-        if node.lexeme.name == "int":
-            return int(node.lexeme.value)
-        elif node.lexeme.name == "float":
-            return float(node.lexeme.value)
-        else:
-            return node_handler(node)
-    elif node_handler is not None:
-        return node_handler(node)
-    else:
-        raise Exception(f"[evaluate_expression] failed to handle node: {node}")
+        return values[0]
+    operand_sequence = get_operand_sequence(node)
+    acc = values[0]
+    op = operand_sequence[0][1]
+    for (operand, next_op), rhs in zip(operand_sequence[1:], values[1:]):
+        if op is None:
+            raise RuntimeError(f"No op provided for {operand.value} at {node.value}")
+        acc = _op_table[op](acc, rhs)
+        op = next_op
+    return acc
+
+
+def _combine_other(node: AstNode, values: T.List[T.Union[int, float]], node_handler: TNodeHandler) -> T.Union[int, float]:
+    # unit productions pass their child's value on, anything else is the handler's
+    return values[0] if values else node_handler(node)
+
+
+# what gets evaluated first: operands of chains, the inside of braces, single children
+_operands = Dispatcher[T.Sequence[AstNode]](
+    by_name={
+        "AddExpr": _chain_operands,
+        "MulExpr": _chain_operands,
+        # NOTE: by shape, the AddExpr is inlined in compact trees
+        "Factor": lambda node: [_skip_units(node.children[1] if len(node.children) == 3 else node)],
+    },
+    default=lambda node: [_skip_units(node)] if len(node.children) == 1 else (),
+)
+_combine = Dispatcher[T.Union[int, float]](
+    by_name={
+        "AddExpr": _combine_chain,
+        "MulExpr": _combine_chain,
+        "int": lambda node, values, node_handler: int(T.cast(Lexeme, node.lexeme).value),
+        "float": lambda node, values, node_handler: float(T.cast(Lexeme, node.lexeme).value),
+    },
+    default=_combine_other,
+)
+
+
+def evaluate_expression(node: AstNode, node_handler: TNodeHandler = _default_handler) -> T.Union[int, float]:
+    """Fold the tree bottom up, `node_handler` gives the value of everything that isn't arithmetic (e.g. variables)"""
+    return fold(node, _combine, _operands, node_handler)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import typing as T
 import logging
 import operator
+from collections import defaultdict
 from dataclasses import dataclass
 from pprint import pprint
 
@@ -8,10 +9,10 @@ from ast_node import AstNode
 from evaluate_expression import evaluate_expression, log as expr_log
 from grammars import fp_language_grammar
 from lexeme import Lexeme
-from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
-from recursive_descent_parser import RecursiveDescentParser, log as rd_log
-from regex_lexer import RegexLexer
+from memoize import memoize
+from recursive_descent_parser import log as rd_log
 from util import print_node
+from visitor import Dispatcher
 
 logging.basicConfig(level=logging.WARN)
 log = logging.getLogger(__name__)
@@ -91,121 +92,245 @@ def get_application_sequence(node: AstNode) -> T.List[AstNode]:
     return result
 
 
-def evaluate_fp_program(root_node: AstNode):
+_unhashable = object()
+
+
+def _memo_value(value: EvalResult) -> T.Any:
+    """Hashable stand-in for a value, `_unhashable` if there is none (yet)"""
+    if isinstance(value, Lazy):
+        # NOTE: forcing it here could change what gets evaluated (or diverge)
+        return _memo_value(getattr(value, "_value")) if hasattr(value, "_value") else _unhashable
+    elif callable(value):
+        # closures are compared by identity, which covers the scope they captured
+        return value
+    try:
+        # NOTE: the type is part of the key, 1 == 1.0 == True
+        return (type(value), hash(value), value)
+    except TypeError:
+        return _unhashable
+
+
+class FpEvalMemo:
+    """Opt-in memoization of `evaluate_fp_program`, fpLang is pure
+
+    Results are cached by (node, values of its free variables).  Functions called
+    from a node also see the innermost scope of the caller (see `Application`), so
+    for nodes containing an application those bindings are part of the key too.
+    The cache is bounded (least recently used entries are evicted) and cleared
+    whenever a statement changes the global scope.
+    """
+
+    memoized_node_names = ("Application", "IfElseExpression", "AddExpr", "MulExpr", "ComparisonExpression")
+
+    def __init__(self, max_size: T.Optional[int] = 10_000):
+        self.max_size = max_size
+        self.cache: T.Dict[T.Any, T.Any] = {}
+        self.stats: T.DefaultDict[str, int] = defaultdict(int)
+        # id(node) -> (free variables, contains an application), cleared per program
+        self._node_info: T.Dict[int, T.Tuple[T.Tuple[str, ...], bool]] = {}
+
+    def clear(self):
+        self.cache.clear()
+
+    def reset(self):
+        """For a new program, node ids may be reused (and stats are per program)"""
+        self.cache.clear()
+        self._node_info.clear()
+        self.stats.clear()
+
+    def node_info(self, node: AstNode) -> T.Tuple[T.Tuple[str, ...], bool]:
+        if id(node) not in self._node_info:
+            if node.name == "identifier":
+                free_variables = {T.cast(Lexeme, node.lexeme).value}
+                has_application = False
+            elif node.name == "Abstraction":
+                body_variables, has_application = self.node_info(node.children[2])
+                free_variables = set(body_variables) - {T.cast(Lexeme, node.children[0].lexeme).value}
+            else:
+                free_variables = set()
+                has_application = node.name == "Application"
+                for child in node.children:
+                    child_variables, child_has_application = self.node_info(child)
+                    free_variables.update(child_variables)
+                    has_application = has_application or child_has_application
+            self._node_info[id(node)] = (tuple(sorted(free_variables)), has_application)
+        return self._node_info[id(node)]
+
+    def make_key(self, node: AstNode, current_scope: "FpScope") -> T.Optional[T.Hashable]:
+        if node.name not in self.memoized_node_names:
+            return None
+        free_variables, has_application = self.node_info(node)
+        values = []
+        for name in free_variables:
+            try:
+                value = _memo_value(current_scope.get(name))
+            except KeyError:
+                return None
+            if value is _unhashable:
+                return None
+            values.append(value)
+        if has_application:
+            for name, scope_value in current_scope.expressions.items():
+                value = _memo_value(scope_value)
+                if value is _unhashable:
+                    return None
+                values.append((name, value))
+        return (id(node), *values)
+
+    def wrap(self, eval_node: T.Callable[[AstNode, "FpScope"], EvalResult]) -> T.Callable[[AstNode, "FpScope"], EvalResult]:
+        # NOTE: only values are cached, an exception may be a cancellation or the recursion guard
+        return memoize(self.make_key, max_size=self.max_size, cache=self.cache, stats=self.stats, cache_exceptions=False)(
+            eval_node
+        )
+
+
+def evaluate_fp_program(
+    root_node: AstNode,
+    checkpoint: T.Optional[T.Callable[[], None]] = None,
+    memo: T.Optional[FpEvalMemo] = None,
+    max_evaluations: int = 1000,
+):
+    """`checkpoint` is called for every node evaluated, and may raise to abandon the evaluation"""
     global_scope = FpScope()
-    recusion_guard = RecursionGuard(max=1000)
+    recusion_guard = RecursionGuard(max=max_evaluations)
+    if memo is not None:
+        memo.reset()
 
-    def eval_node(node: AstNode, current_scope: FpScope):
-        recusion_guard.inc()
-        log.debug(f"[eval_node] {node.name} {node.value}")
-        log.debug(f"[eval_node] scope:\n{current_scope}")
+    # NOTE: checked once, formatting scopes for every node visited dominated the run time
+    debug = log.isEnabledFor(logging.DEBUG)
 
-        def _force_eval(_node: AstNode, scope: FpScope):
-            result = _node
-            while True:
+    def _force_eval(_node: AstNode, scope: FpScope):
+        result = _node
+        while True:
+            if debug:
                 log.debug(f"[_force_eval] {result}")
-                if isinstance(result, Lazy):
-                    result = Lazy.unlazy(result)
-                elif isinstance(result, AstNode):
-                    result = eval_node(result, scope)
-                else:
-                    return result
-
-        if node.name == "AddExpr":
-
-            def handle_node(_node: AstNode) -> T.Union[int, float]:
-                result = _force_eval(_node, current_scope)
-                if isinstance(result, (int, float)):
-                    return result
-                else:
-                    raise Exception(f"could not handle {_node.value}: {result}")
+            if isinstance(result, Lazy):
+                result = Lazy.unlazy(result)
+            elif isinstance(result, AstNode):
+                result = eval_node(result, scope)
+            else:
+                return result
 
-            return evaluate_expression(node, node_handler=handle_node)
+    def _eval_arithmetic(node: AstNode, current_scope: FpScope):
+        def handle_node(_node: AstNode) -> T.Union[int, float]:
+            result = _force_eval(_node, current_scope)
+            if isinstance(result, (int, float)):
+                return result
+            else:
+                raise Exception(f"could not handle {_node.value}: {result}")
 
-        elif node.name == "ComparisonExpression":
+        return evaluate_expression(node, node_handler=handle_node)
 
-            _op = T.cast(Lexeme, node.children[1].lexeme).value
-            _l = _force_eval(node.children[0], current_scope)
-            _r = _force_eval(node.children[2], current_scope)
+    def _eval_comparison(node: AstNode, current_scope: FpScope):
+        _op = T.cast(Lexeme, node.children[1].lexeme).value
+        _l = _force_eval(node.children[0], current_scope)
+        _r = _force_eval(node.children[2], current_scope)
+        if debug:
             log.debug(f"[ComparisonExpression] {_l} {_op} {_r}")
-            return _comparison_op_table[_op](_l, _r)
-
-        elif node.name == "IfElseExpression":
-
-            _comparison_result = _force_eval(node.children[2], current_scope)
-            if not isinstance(_comparison_result, bool):
-                raise Exception(f"[IfElseExpression] invalid comparison result: {_comparison_result}")
-            if _comparison_result:
-                return eval_node(node.children[4], current_scope)
-            else:
-                return eval_node(node.children[6], current_scope)
+        return _comparison_op_table[_op](_l, _r)
+
+    def _eval_if_else(node: AstNode, current_scope: FpScope):
+        _comparison_result = _force_eval(node.children[2], current_scope)
+        if not isinstance(_comparison_result, bool):
+            raise Exception(f"[IfElseExpression] invalid comparison result: {_comparison_result}")
+        if _comparison_result:
+            return eval_node(node.children[4], current_scope)
+        else:
+            return eval_node(node.children[6], current_scope)
 
-        elif node.name == "Abstraction":
+    def _eval_abstraction(node: AstNode, current_scope: FpScope):
+        variable_name = T.cast(Lexeme, node.children[0].lexeme).value
 
-            if isinstance(node, AstNode):
-                variable_name = T.cast(Lexeme, node.children[0].lexeme).value
-            else:
-                variable_name = getattr(node, "variable_name")
-
-            def _f(x, application_sequence_scope: FpScope):
+        def _f(x, application_sequence_scope: FpScope):
+            if debug:
                 log.debug(f"application_sequence_scope: {application_sequence_scope}")
-                inner_scope = FpScope(current_scope)
-                inner_scope.expressions |= application_sequence_scope.expressions
-                if isinstance(x, AstNode):
-                    inner_scope.expressions[variable_name] = eval_node(x, inner_scope)
-                else:
-                    inner_scope.expressions[variable_name] = x
+            inner_scope = FpScope(current_scope)
+            inner_scope.expressions |= application_sequence_scope.expressions
+            if isinstance(x, AstNode):
+                inner_scope.expressions[variable_name] = eval_node(x, inner_scope)
+            else:
+                inner_scope.expressions[variable_name] = x
+            if debug:
                 log.debug(f"[Abstraction] {node.value} [{variable_name} <- {inner_scope.expressions[variable_name]}]")
-                return Lazy(lambda: eval_node(node.children[2], inner_scope))
-
-            setattr(_f, "variable_name", variable_name)
+            return Lazy(lambda: eval_node(node.children[2], inner_scope))
 
-            return _f
+        setattr(_f, "variable_name", variable_name)
 
-        elif node.name == "Application":
+        return _f
 
-            application_sequence = get_application_sequence(node)
-            application_sequence_scope = current_scope.clone()
+    def _eval_application(node: AstNode, current_scope: FpScope):
+        application_sequence = get_application_sequence(node)
+        application_sequence_scope = current_scope.clone()
 
-            TFn = T.Callable[[T.Any, FpScope], AstNode | Lazy]
+        TFn = T.Callable[[T.Any, FpScope], AstNode | Lazy]
 
-            _fn = T.cast(TFn, _force_eval(application_sequence[0].children[0], application_sequence_scope))
-            for application in application_sequence[1:]:
-                if not callable(_fn):
-                    raise Exception(f"[Application] subexpression was not callable: {node.value}")
-                # NOTE: the _arg is really the next function-identifier
-                _arg = eval_node(application.children[0], application_sequence_scope)
-                _result = _fn(_arg, application_sequence_scope)
-                _fn = T.cast(TFn, _force_eval(_result, application_sequence_scope))
+        _fn = T.cast(TFn, _force_eval(application_sequence[0].children[0], application_sequence_scope))
+        for application in application_sequence[1:]:
+            if not callable(_fn):
+                raise Exception(f"[Application] subexpression was not callable: {node.value}")
+            # NOTE: the _arg is really the next function-identifier
+            _arg = eval_node(application.children[0], application_sequence_scope)
+            _result = _fn(_arg, application_sequence_scope)
+            _fn = T.cast(TFn, _force_eval(_result, application_sequence_scope))
 
-            args = application_sequence[-1].children[1]
-            return _fn(args, application_sequence_scope)
+        args = application_sequence[-1].children[1]
+        return _fn(args, application_sequence_scope)
 
-        elif node.name == "identifier":
-            return current_scope.get(T.cast(Lexeme, node.lexeme).value)
-
-        elif node.matches_production("Program", "Statements Expression"):
-            eval_node(node.children[0], current_scope)
-            return eval_node(node.children[1], current_scope)
+    def _eval_sequence(node: AstNode, current_scope: FpScope):
+        """`Program -> Statements Expression` and `Statements -> Statement Statements`"""
+        if len(node.children) == 1:
+            return eval_node(node.children[0], current_scope)
+        eval_node(node.children[0], current_scope)
+        result = eval_node(node.children[1], current_scope)
+        return result if node.name == "Program" else None
 
-        elif node.matches_production("Statements", "Statement Statements"):
-            eval_node(node.children[0], current_scope)
-            eval_node(node.children[1], current_scope)
-            return
+    def _eval_statement(node: AstNode, current_scope: FpScope):
+        identifier = T.cast(Lexeme, node.children[1].lexeme).value
+        current_scope.expressions[identifier] = eval_node(node.children[3], current_scope)
+        if memo is not None:
+            memo.clear()
 
-        elif node.name == "Statement":
-            identifier = T.cast(Lexeme, node.children[1].lexeme).value
-            current_scope.expressions[identifier] = eval_node(node.children[3], current_scope)
-            return
+    def _eval_braced(node: AstNode, current_scope: FpScope):
+        return eval_node(node.children[1] if len(node.children) == 3 else node.children[0], current_scope)
 
-        elif node.name == "BracedExpression":
-            return eval_node(node.children[1], current_scope)
+    def _eval_unit(node: AstNode, current_scope: FpScope):
+        if len(node.children) != 1:
+            raise Exception(f"[eval_node] unhandled node: {node.name}")
+        return eval_node(node.children[0], current_scope)
+
+    handlers = Dispatcher[EvalResult](
+        by_name={
+            "AddExpr": _eval_arithmetic,
+            "MulExpr": _eval_arithmetic,
+            "ComparisonExpression": _eval_comparison,
+            "IfElseExpression": _eval_if_else,
+            "Abstraction": _eval_abstraction,
+            "Application": _eval_application,
+            "identifier": lambda node, current_scope: current_scope.get(T.cast(Lexeme, node.lexeme).value),
+            # NOTE: literals are only reached directly in simplified trees (see simplify)
+            "int": lambda node, current_scope: evaluate_expression(node),
+            "float": lambda node, current_scope: evaluate_expression(node),
+            "bool": lambda node, current_scope: T.cast(Lexeme, node.lexeme).value == "True",
+            "Program": _eval_sequence,
+            "Statements": _eval_sequence,
+            "Statement": _eval_statement,
+            "BracedExpression": _eval_braced,
+            "Factor": _eval_braced,
+        },
+        default=_eval_unit,
+    )
 
-        elif len(node.children) == 1:
-            return eval_node(node.children[0], current_scope)
+    def eval_node(node: AstNode, current_scope: FpScope):
+        recusion_guard.inc()
+        if checkpoint is not None:
+            checkpoint()
+        if debug:
+            log.debug(f"[eval_node] {node.name} {node.value}")
+            log.debug(f"[eval_node] scope:\n{current_scope}")
+        return handlers.lookup(node)(node, current_scope)
 
-        else:
-            raise Exception(f"[eval_node] unhandled node: {node.name}")
+    if memo is not None:
+        eval_node = memo.wrap(eval_node)
 
     return Lazy.unlazy(eval_node(root_node, global_scope))
 
@@ -213,12 +338,18 @@ def evaluate_fp_program(root_node: AstNode):
 if __name__ == "__main__":
     import argparse
     import sys
+    from grammar_registry import registry
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-v-rd", action="store_true")
     parser.add_argument("-v-fp", action="store_true")
     parser.add_argument("-v-expr", action="store_true")
     parser.add_argument("-i", choices=fp_language_grammar.examples.keys())
+    parser.add_argument("--memoize", action="store_true", help="memoize pure subexpressions")
+    parser.add_argument("--memo-size", type=int, default=10_000)
+    parser.add_argument("--check", metavar="PATH", help="report every syntax error in an fpLang program")
+    parser.add_argument("--compact", action="store_true", help="parse to compact trees (see RecursiveDescentParser)")
+    parser.add_argument("--fib", type=int, help="time naive fibonacci in fpLang, with and without --memoize")
 
     args = parser.parse_args(sys.argv[1:])
 
@@ -229,16 +360,42 @@ if __name__ == "__main__":
     if args.v_expr:
         expr_log.setLevel(logging.DEBUG)
 
-    lexer = RegexLexer(fp_language_grammar.terminals)
+    lexer = registry.lexer(fp_language_grammar)
+    memo = FpEvalMemo(args.memo_size) if args.memoize else None
+
+    if args.check is not None:
+        with open(args.check) as f:
+            lexemes = list(lexer(f.read()))
+        _, errors = registry.parser(fp_language_grammar, "memoized").parse_with_recovery(
+            lexemes, "Statement", "Expression", ("semicolon",)
+        )
+        for error in errors:
+            print(f"{args.check}: {error}")
+        sys.exit(1 if errors else 0)
+
+    if args.fib is not None:
+        import time
+
+        sys.setrecursionlimit(100_000)
+        # NOTE: `0 +` because SubExpression tries BracedExpression before AddExpr
+        text = f"let fib = n -> if (n < 2) n else 0 + (fib (n - 1)) + (fib (n - 2)); fib {args.fib}"
+        root_node = registry.parser(fp_language_grammar, "memoized", args.compact).parse(list(lexer(text)), fp_language_grammar.start_symbol, 0)
+        for _memo in (None, FpEvalMemo(args.memo_size)):
+            start_time = time.perf_counter()
+            result = evaluate_fp_program(root_node, memo=_memo, max_evaluations=sys.maxsize)
+            print(f"fib {args.fib} = {result} ({time.perf_counter() - start_time:.4f}s, memo stats: {dict(_memo.stats) if _memo else None})")
+        sys.exit()
 
     for name, text in fp_language_grammar.examples.items():
         if args.i is not None and name != args.i:
             continue
         lexemes = list(lexer(text))
-        memoized_parser = MemoizedRecursiveDescentParser(fp_language_grammar.productions)
+        memoized_parser = registry.parser(fp_language_grammar, "memoized", args.compact)
         root_node = memoized_parser.parse(lexemes, fp_language_grammar.start_symbol, 0)
         if args.v_rd:
             print_node(root_node)
-        result = evaluate_fp_program(root_node)
+        result = evaluate_fp_program(root_node, memo=memo)
         print(f"{name}: {text}")
         pprint(result)
+        if memo is not None:
+            print(f"memo stats: {dict(memo.stats)}")
@@ -1,5 +1,5 @@
 import typing as T
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from common_types import NamedTerminal, THead, TProduction
 
 
@@ -10,3 +10,6 @@ class Grammar:
     productions: T.List[TProduction]
     start_symbol: THead
     examples: T.Dict[str, str]
+    # lexer options, see RegexLexer
+    longest_match: bool = False
+    keywords: T.Dict[str, str] = field(default_factory=dict)
@@ -0,0 +1,414 @@
+import math
+import typing as T
+from collections import deque
+from dataclasses import dataclass, field
+
+from common_types import TBody, THead, TParseTable
+from grammar import Grammar
+from recursive_descent_parser import make_parse_table
+
+TGraph = T.Dict[str, T.Set[str]]
+
+
+def min_lengths(table: TParseTable) -> T.Dict[THead, int]:
+    """Fixed point for the number of tokens of the shortest derivation, 0 for nullable nonterminals"""
+    lengths: T.Dict[THead, int] = {}
+    changed = True
+    while changed:
+        changed = False
+        for head, bodies in table.items():
+            for _, symbols in bodies:
+                if all(is_lexeme or symbol in lengths for symbol, is_lexeme in symbols):
+                    length = sum(1 if is_lexeme else lengths[symbol] for symbol, is_lexeme in symbols)
+                    if length < lengths.get(head, length + 1):
+                        lengths[head] = length
+                        changed = True
+    return lengths
+
+
+def first_sets(table: TParseTable, nullable: T.AbstractSet[str]) -> T.Dict[THead, T.FrozenSet[str]]:
+    """Terminals each nonterminal can start with"""
+    first: T.Dict[THead, T.Set[str]] = {head: set() for head in table}
+    changed = True
+    while changed:
+        changed = False
+        for head, bodies in table.items():
+            for _, symbols in bodies:
+                extended = first[head] | sequence_first(symbols, first, nullable)
+                if extended != first[head]:
+                    first[head] = extended
+                    changed = True
+    return {head: frozenset(terminals) for head, terminals in first.items()}
+
+
+def sequence_first(
+    symbols: T.Sequence[T.Tuple[str, bool]], first: T.Mapping[str, T.AbstractSet[str]], nullable: T.AbstractSet[str]
+) -> T.Set[str]:
+    result: T.Set[str] = set()
+    for symbol, is_lexeme in symbols:
+        if is_lexeme:
+            result.add(symbol)
+            break
+        result |= first.get(symbol, set())
+        if symbol not in nullable:
+            break
+    return result
+
+
+def left_corners(symbols: T.Sequence[T.Tuple[str, bool]], nullable: T.AbstractSet[str]) -> T.List[str]:
+    """Nonterminals a body calls before consuming anything"""
+    corners = []
+    for symbol, is_lexeme in symbols:
+        if is_lexeme:
+            break
+        corners.append(symbol)
+        if symbol not in nullable:
+            break
+    return corners
+
+
+def _closure(graph: TGraph, start: T.Iterable[str]) -> T.Set[str]:
+    reached = set(start)
+    pending = list(reached)
+    while pending:
+        for target in graph.get(pending.pop(), ()):
+            if target not in reached:
+                reached.add(target)
+                pending.append(target)
+    return reached
+
+
+def components(graph: TGraph) -> T.List[T.Set[str]]:
+    """Strongly connected components (Tarjan), callees before callers"""
+    index: T.Dict[str, int] = {}
+    low: T.Dict[str, int] = {}
+    stack: T.List[str] = []
+    on_stack: T.Set[str] = set()
+    result: T.List[T.Set[str]] = []
+
+    def visit(node: str):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for target in graph.get(node, ()):
+            if target not in index:
+                visit(target)
+                low[node] = min(low[node], low[target])
+            elif target in on_stack:
+                low[node] = min(low[node], index[target])
+        if low[node] == index[node]:
+            component = set()
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.add(member)
+                if member == node:
+                    break
+            result.append(component)
+
+    for node in graph:
+        if node not in index:
+            visit(node)
+    return result
+
+
+def _path(graph: TGraph, source: str, target: str, allowed: T.Callable[[str, str], bool] = lambda u, v: True) -> T.Optional[T.List[str]]:
+    """Shortest path (breadth first), `[source, ..., target]`"""
+    parents: T.Dict[str, T.Optional[str]] = {source: None}
+    pending = deque([source])
+    while pending:
+        node = pending.popleft()
+        for next_node in sorted(graph.get(node, ())):
+            if not allowed(node, next_node):
+                continue
+            if next_node == target:
+                path = [target, node]
+                while parents[path[-1]] is not None:
+                    path.append(T.cast(str, parents[path[-1]]))
+                return path[::-1]
+            if next_node not in parents:
+                parents[next_node] = node
+                pending.append(next_node)
+    return None
+
+
+@dataclass
+class Edge:
+    """`head` calling `symbol`, over every occurrence of `symbol` in the bodies of `head`"""
+
+    # calls at the same position per call of `head`, i.e. alternatives reaching `symbol` before consuming
+    # anything, or sharing the prefix in front of it: all of them are tried when the earlier ones fail
+    calls: int = 1
+    # fewest tokens consumed in front of it
+    tokens: int = 0
+    # some occurrence can end the body, so the call stack can grow with the length of flat input
+    tail: bool = False
+
+
+@dataclass
+class Overlap:
+    head: THead
+    first: TBody
+    second: TBody
+    terminals: T.FrozenSet[str]
+
+
+@dataclass
+class Growth:
+    """A cycle of calls multiplying the work of each trip around it by `base`"""
+
+    cycle: T.List[str]
+    base: int
+    # fewest tokens consumed per trip
+    tokens: int
+    # every call on the cycle can be in tail position, so flat input (`x * x * ...`) makes it recurse
+    flat: bool
+
+    def describe(self) -> str:
+        cycle = " -> ".join(self.cycle)
+        if self.flat:
+            return f"exponential in input length, ~{self.base}^(n/{max(self.tokens, 1)}) calls ({cycle})"
+        return f"exponential in nesting depth, ~{self.base}^depth calls ({cycle})"
+
+
+@dataclass
+class GrammarReport:
+    grammar_name: str
+    nonterminals: T.List[THead]
+    undefined: T.Set[str] = field(default_factory=set)
+    unproductive: T.Set[THead] = field(default_factory=set)
+    nullable: T.Set[THead] = field(default_factory=set)
+    first: T.Dict[THead, T.FrozenSet[str]] = field(default_factory=dict)
+    # cycles of calls that consume nothing, and the nullable symbols skipped on the way
+    left_recursion: T.List[T.Tuple[T.List[str], T.List[str]]] = field(default_factory=list)
+    overlaps: T.List[Overlap] = field(default_factory=list)
+    # (head, body, earlier body) where the earlier body is a prefix, so ordered choice never gets to `body`
+    shadowed: T.List[T.Tuple[THead, TBody, TBody]] = field(default_factory=list)
+    edges: T.Dict[T.Tuple[THead, THead], Edge] = field(default_factory=dict)
+    growth: T.List[Growth] = field(default_factory=list)
+    # worst re-parse factor of a call outside exponential cycles
+    reparse_factor: int = 1
+    # nonterminal -> why: memoizing these removes every exponential cycle
+    memoize: T.Dict[THead, str] = field(default_factory=dict)
+    # re-parsed recursive rules off those cycles, a constant factor of time against memo memory
+    optional: T.Dict[THead, str] = field(default_factory=dict)
+    # estimates once `memoize` is memoized
+    memoized_growth: T.List[Growth] = field(default_factory=list)
+    memoized_reparse_factor: int = 1
+
+    def complexity(self) -> T.Dict[str, str]:
+        """Worst case estimate for each parser type"""
+        if self.left_recursion:
+            cycle = " -> ".join(self.left_recursion[0][0])
+            return {parser_type: f"does not terminate, left recursion ({cycle})" for parser_type in ("normal", "memoized", "selective")}
+        n = len(self.nonterminals)
+
+        def estimate(growth: T.List[Growth], reparse_factor: int) -> str:
+            if any(g.flat for g in growth):
+                return "; ".join(g.describe() for g in growth)
+            linear = f"linear, up to {reparse_factor}x re-parsing" if reparse_factor > 1 else "linear"
+            return "; ".join([linear, *(g.describe() for g in growth)])
+
+        return {
+            "normal": estimate(self.growth, self.reparse_factor),
+            "memoized": f"linear, up to {n} memo entries per lexeme",
+            "selective": (
+                f"{estimate(self.memoized_growth, self.memoized_reparse_factor)}, "
+                f"up to {len(self.memoize)} memo entries per lexeme (memoized={sorted(self.memoize)})"
+            ),
+        }
+
+    def format(self) -> str:
+        lines = [f"*** {self.grammar_name} ***"]
+        for what, symbols in (("undefined", self.undefined), ("unproductive", self.unproductive), ("nullable", self.nullable)):
+            if symbols:
+                lines.append(f"{what}: {', '.join(sorted(symbols))}")
+        for cycle, skipped in self.left_recursion:
+            hidden = f", hidden behind nullable {', '.join(skipped)}" if skipped else ""
+            lines.append(f"left recursion: {' -> '.join(cycle)}{hidden}")
+        for head, body, earlier in self.shadowed:
+            lines.append(f"never used: {head} -> {body}, `{head} -> {earlier}` is tried first and is a prefix of it")
+        for overlap in self.overlaps:
+            lines.append(
+                f"FIRST overlap: {overlap.head} -> {overlap.first} | {overlap.second} both start with {', '.join(sorted(overlap.terminals))}"
+            )
+        for (head, symbol), edge in sorted(self.edges.items()):
+            if edge.calls > 1:
+                lines.append(f"re-parsed: {symbol} up to {edge.calls}x at the same position by {head}")
+        for parser_type, estimate in self.complexity().items():
+            lines.append(f"{parser_type:9}: {estimate}")
+        for nonterminal, reason in self.memoize.items():
+            lines.append(f"memoize {nonterminal}: {reason}")
+        for nonterminal, reason in self.optional.items():
+            lines.append(f"optionally memoize {nonterminal}: {reason}")
+        return "\n".join(lines)
+
+
+def _growth(graph: TGraph, edges: T.Mapping[T.Tuple[str, str], Edge], memoized: T.AbstractSet[str]) -> T.Tuple[T.List[Growth], int]:
+    """Exponential cycles, and the re-parse factor along the acyclic part of the call graph
+
+    A call of a memoized nonterminal is only worked out once per position, so its
+    re-parses don't multiply.
+    """
+
+    def calls(u: str, v: str) -> int:
+        return 1 if v in memoized else edges[(u, v)].calls
+
+    growth: T.List[Growth] = []
+    factor: T.Dict[str, int] = {}
+    component_of: T.Dict[str, int] = {}
+    for i, component in enumerate(components(graph)):
+        for node in component:
+            component_of[node] = i
+        worst: T.Optional[Growth] = None
+        for u in sorted(component):
+            for v in sorted(graph[u] & component):
+                if calls(u, v) < 2:
+                    continue
+                inside = lambda a, b: b in component
+                path = _path(graph, v, u, lambda a, b: inside(a, b) and edges[(a, b)].tail)
+                flat = path is not None and edges[(u, v)].tail
+                path = path or _path(graph, v, u, inside)
+                cycle = [u, *T.cast(T.List[str], path)] if v != u else [u, u]
+                trip = list(zip(cycle, cycle[1:]))
+                candidate = Growth(
+                    cycle,
+                    math.prod(calls(a, b) for a, b in trip),
+                    sum(edges[(a, b)].tokens for a, b in trip),
+                    flat,
+                )
+                if worst is None or (candidate.flat, candidate.base) > (worst.flat, worst.base):
+                    worst = candidate
+        if worst is not None:
+            growth.append(worst)
+        # components come callees first, so their factors are known
+        for node in component:
+            factor[node] = max(
+                (calls(node, target) * factor[target] for target in graph[node] if target not in component),
+                default=1,
+            )
+    return growth, max(factor.values(), default=1)
+
+
+def analyze(grammar: Grammar) -> GrammarReport:
+    """Static checks for a recursive descent parser with ordered choice, and where to memoize
+
+    Estimates are upper bounds from the shape of the grammar: every alternative is
+    assumed to be able to fail after its prefix, so a nonterminal reached by `k`
+    alternatives of its caller at the same position is parsed `k` times.
+    NOTE: re-parses through different paths (only visible as a FIRST overlap)
+    aren't multiplied in.
+    """
+    table = make_parse_table(grammar.productions)
+    report = GrammarReport(grammar.name, list(table))
+    lengths = min_lengths(table)
+    report.unproductive = set(table) - set(lengths)
+    report.nullable = {head for head, length in lengths.items() if length == 0}
+    report.first = first_sets(table, report.nullable)
+    nullable = report.nullable
+
+    # left corner graph, calls made before consuming anything
+    corner_graph: TGraph = {head: set() for head in table}
+    skipped: T.Dict[T.Tuple[str, str], T.List[str]] = {}
+    for head, bodies in table.items():
+        for _, symbols in bodies:
+            corners = left_corners(symbols, nullable)
+            for i, corner in enumerate(corners):
+                corner_graph[head].add(corner)
+                skipped.setdefault((head, corner), corners[:i])
+    for component in components(corner_graph):
+        node = min(component)
+        if len(component) == 1 and node not in corner_graph.get(node, ()):
+            continue
+        cycle = _path(corner_graph, node, node)
+        if cycle is not None:
+            report.left_recursion.append((cycle, [s for u, v in zip(cycle, cycle[1:]) for s in skipped[(u, v)]]))
+
+    # call graph, with how often each call is repeated at the same position
+    graph: TGraph = {head: set() for head in table}
+    for head, bodies in table.items():
+        reached = [_closure(corner_graph, left_corners(symbols, nullable)) for _, symbols in bodies]
+        prefixes: T.Dict[T.Tuple[str, ...], int] = {}
+        for _, symbols in bodies:
+            for i in range(len(symbols)):
+                prefix = tuple(symbol for symbol, _ in symbols[: i + 1])
+                prefixes[prefix] = prefixes.get(prefix, 0) + 1
+        for (body, symbols), corners in zip(bodies, reached):
+            tokens = 0
+            for i, (symbol, is_lexeme) in enumerate(symbols):
+                if not is_lexeme:
+                    if symbol not in table:
+                        report.undefined.add(symbol)
+                    else:
+                        graph[head].add(symbol)
+                        edge = report.edges.setdefault((head, symbol), Edge(tokens=tokens))
+                        edge.tokens = min(edge.tokens, tokens)
+                        edge.tail = edge.tail or all(s in nullable for s, _ in symbols[i + 1 :])
+                        same_position = prefixes[tuple(s for s, _ in symbols[: i + 1])]
+                        if tokens == 0 and i == 0:
+                            same_position = max(same_position, sum(symbol in c for c in reached))
+                        edge.calls = max(edge.calls, same_position)
+                tokens += 1 if is_lexeme else lengths.get(symbol, 0)
+
+        # ordered choice: FIRST overlaps, and alternatives hidden behind a prefix
+        for i, (body, symbols) in enumerate(bodies):
+            first = sequence_first(symbols, report.first, nullable)
+            for earlier, earlier_symbols in bodies[:i]:
+                if earlier_symbols == symbols[: len(earlier_symbols)]:
+                    report.shadowed.append((head, body, earlier))
+                shared = frozenset(first & sequence_first(earlier_symbols, report.first, nullable))
+                if shared:
+                    report.overlaps.append(Overlap(head, earlier, body, shared))
+
+    report.growth, report.reparse_factor = _growth(graph, report.edges, set())
+
+    # memoize a re-parsed call on each exponential cycle until none is left, the
+    # worst (most calls, first on the cycle) first
+    memoized: T.Set[str] = set()
+    # NOTE: no memo helps a left recursive grammar, the parse never gets to store anything
+    growth = [] if report.left_recursion else report.growth
+    while growth:
+        cycle = growth[0].cycle
+        calls, _, head, symbol = max(
+            (report.edges[(u, v)].calls, -i, u, v) for i, (u, v) in enumerate(zip(cycle, cycle[1:])) if v not in memoized
+        )
+        memoized.add(symbol)
+        report.memoize[symbol] = f"parsed up to {calls}x at the same position by {head}, on {' -> '.join(cycle)}"
+        growth = _growth(graph, report.edges, memoized)[0]
+
+    # the other re-parsed calls cost a constant factor, worth it when the call recurses
+    recursive = {node for component in components(graph) for node in component if len(component) > 1 or node in graph[node]}
+    unbounded = {head for head in table if _closure(graph, [head]) & recursive}
+    for (head, symbol), edge in sorted(report.edges.items()):
+        if edge.calls > 1 and symbol in unbounded and symbol not in report.memoize:
+            reason = f"parsed up to {edge.calls}x at the same position by {head}"
+            report.optional[symbol] = f"{report.optional[symbol]}, {reason}" if symbol in report.optional else reason
+    report.memoized_growth, report.memoized_reparse_factor = _growth(graph, report.edges, memoized)
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    import timeit
+    from grammars import bad_expression_grammar, expression_grammar, fp_language_grammar
+    from grammar_registry import registry
+    from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
+
+    sys.setrecursionlimit(100_000)
+    for grammar in (expression_grammar, bad_expression_grammar, fp_language_grammar):
+        report = analyze(grammar)
+        print(report.format())
+        lexer = registry.lexer(grammar)
+        parsers = {
+            "memoized": MemoizedRecursiveDescentParser(grammar.productions),
+            "selective": MemoizedRecursiveDescentParser(grammar.productions, memoized=report.memoize),
+        }
+        for example_name, example in list(grammar.examples.items())[-2:]:
+            lexemes = list(lexer(example))
+            for name, parser in parsers.items():
+                result, context = parser.parse_with_context(lexemes, grammar.start_symbol)
+                seconds = min(timeit.repeat(lambda: parser.parse_with_context(lexemes, grammar.start_symbol), number=10, repeat=3)) / 10
+                print(
+                    f"  {example_name:16} {name:9} {context.total_calls:6} calls {len(context.memo):5} memo entries  {seconds:.6f}s"
+                )
+        print()
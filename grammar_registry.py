@@ -0,0 +1,165 @@
+import hashlib
+import marshal
+import os
+import typing as T
+
+from common_types import TParseTable
+from grammar import Grammar
+from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
+from recursive_descent_parser import RecursiveDescentParser, make_parse_table
+from dfa_lexer import Dfa, DfaLexer
+from regex_lexer import RegexLexer
+
+# bump when the layout of the cached tables changes
+_cache_version = 2
+
+
+def grammar_fingerprint(grammar: Grammar) -> str:
+    """Identifies a grammar by its content, so a stale cache entry is never used"""
+    content = repr((grammar.terminals, grammar.productions, grammar.start_symbol, grammar.longest_match, grammar.keywords))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class GrammarRegistry:
+    """Builds the lexer and parse table of each grammar once per process
+
+    With a `cache_path`, the parse tables and DFA lexer tables (plain dicts, lists,
+    tuples and strings) are read from that marshal file, and it is rewritten
+    whenever a grammar missing from it is built, so a fresh worker process doesn't
+    analyse any grammar one has seen before.  Compiled regexes can't be
+    marshalled, they're compiled once per process, when the lexer is first asked for.
+
+    Parsers keep no state between calls (see `ParseContext`), so one instance per
+    grammar, parser type and tree shape is shared by every caller.
+    """
+
+    _tables: T.Dict[str, TParseTable]
+    # fingerprint -> `Dfa.tables()`
+    _dfas: T.Dict[str, T.Dict[str, T.Any]]
+    _lexers: T.Dict[T.Tuple[str, str], RegexLexer]
+    _parsers: T.Dict[T.Tuple[str, str, bool], RecursiveDescentParser]
+    # id(grammar) -> (grammar, fingerprint), the grammar is kept so its id isn't reused
+    _fingerprints: T.Dict[int, T.Tuple[Grammar, str]]
+
+    def __init__(self, cache_path: T.Optional[str] = None):
+        self._tables = {}
+        self._dfas = {}
+        self._lexers = {}
+        self._parsers = {}
+        self._fingerprints = {}
+        self.cache_path = cache_path
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load(cache_path)
+
+    def _key(self, grammar: Grammar) -> str:
+        if id(grammar) not in self._fingerprints:
+            self._fingerprints[id(grammar)] = (grammar, grammar_fingerprint(grammar))
+        return self._fingerprints[id(grammar)][1]
+
+    def lexer(self, grammar: Grammar, backend: T.Literal["regex", "dfa"] = "regex") -> RegexLexer:
+        key = self._key(grammar)
+        lexer_key = (key, backend)
+        if lexer_key not in self._lexers:
+            options = dict(longest_match=grammar.longest_match, keywords=grammar.keywords)
+            if backend == "regex":
+                self._lexers[lexer_key] = RegexLexer(grammar.terminals, **options)
+            elif key in self._dfas:
+                self._lexers[lexer_key] = DfaLexer(grammar.terminals, dfa=Dfa.from_tables(self._dfas[key]), **options)
+            else:
+                lexer = self._lexers[lexer_key] = DfaLexer(grammar.terminals, **options)
+                self._dfas[key] = lexer.dfa.tables()
+                self._built()
+        return self._lexers[lexer_key]
+
+    def parse_table(self, grammar: Grammar) -> TParseTable:
+        key = self._key(grammar)
+        if key not in self._tables:
+            self._tables[key] = make_parse_table(grammar.productions)
+            self._built()
+        return self._tables[key]
+
+    def _built(self):
+        """Something missing from the cache was built, write it for the next process"""
+        if self.cache_path is not None:
+            self.save()
+
+    def parser(
+        self,
+        grammar: Grammar,
+        parser_type: T.Literal["normal", "memoized"] = "normal",
+        compact: bool = False,
+    ) -> RecursiveDescentParser:
+        parser_key = (self._key(grammar), parser_type, compact)
+        if parser_key not in self._parsers:
+            parser_class = MemoizedRecursiveDescentParser if parser_type == "memoized" else RecursiveDescentParser
+            self._parsers[parser_key] = parser_class(grammar.productions, table=self.parse_table(grammar), compact=compact)
+        return self._parsers[parser_key]
+
+    def save(self, path: T.Optional[str] = None):
+        path = self.cache_path if path is None else path
+        if path is None:
+            raise ValueError("[GrammarRegistry] no cache path")
+        # NOTE: write-then-rename, several workers may be starting at once; entries
+        # another one wrote meanwhile are kept (one racing this rename is just rebuilt)
+        if os.path.exists(path):
+            self.load(path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(marshal.dumps({"version": _cache_version, "tables": self._tables, "dfas": self._dfas}))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        try:
+            with open(path, "rb") as f:
+                # NOTE: one read, `marshal.load` reads the file a few bytes at a time
+                cached = marshal.loads(f.read())
+        except (EOFError, ValueError, TypeError):
+            # unreadable or from another python version, it'll be rebuilt
+            return
+        if isinstance(cached, dict) and cached.get("version") == _cache_version:
+            for key, table in cached["tables"].items():
+                self._tables.setdefault(key, table)
+            for key, tables in cached["dfas"].items():
+                self._dfas.setdefault(key, tables)
+
+
+# process wide registry, workers can share tables through the file in GRAMMAR_CACHE
+registry = GrammarRegistry(os.environ.get("GRAMMAR_CACHE"))
+
+
+if __name__ == "__main__":
+    import tempfile
+    import timeit
+    from grammars import expression_grammar, bad_expression_grammar, fp_language_grammar
+
+    grammars = [expression_grammar, bad_expression_grammar, fp_language_grammar]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, "grammars.marshal")
+
+        def worker_start(cache_path: T.Optional[str]) -> GrammarRegistry:
+            """What a fresh worker process does"""
+            fresh = GrammarRegistry(cache_path)
+            for grammar in grammars:
+                fresh.lexer(grammar, "dfa")
+                fresh.parser(grammar)
+            return fresh
+
+        # the first worker writes the cache as it goes
+        warm = worker_start(cache_path)
+
+        def per_call_setup():
+            for grammar in grammars:
+                RegexLexer(grammar.terminals)
+                RecursiveDescentParser(grammar.productions)
+
+        def registry_setup():
+            for grammar in grammars:
+                warm.lexer(grammar)
+                warm.parser(grammar)
+
+        print(f"per call setup: {timeit.timeit(per_call_setup, number=1000):.4f}s / 1000")
+        print(f"registry setup: {timeit.timeit(registry_setup, number=1000):.4f}s / 1000")
+        print(f"worker start without cache: {timeit.timeit(lambda: worker_start(None), number=20) / 20 * 1000:.2f}ms")
+        print(f"worker start with cache:    {timeit.timeit(lambda: worker_start(cache_path), number=20) / 20 * 1000:.2f}ms")
+        cached = GrammarRegistry(cache_path)
+        print(f"cached: {len(cached._tables)} tables, {len(cached._dfas)} dfas ({os.path.getsize(cache_path)} bytes)")
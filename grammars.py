@@ -13,7 +13,8 @@ expression_grammar = Grammar(
         ("rbrace", r"\)"),
         ("var", r"[a-zA-Z_]+"),
         ("int", r"0|[1-9][0-9]*"),
-        ("float", r"((0|[1-9][0-9]*)\.)|(\.[0-9]+)|((0|[1-9][0-9]*)\.[0-9]+)"),
+        # NOTE: longest alternative first, `re` takes the first alternative that matches
+        ("float", r"(0|[1-9][0-9]*)\.[0-9]+|(0|[1-9][0-9]*)\.|\.[0-9]+"),
     ],
     [
         ("AddExpr", "MulExpr add_op AddExpr"),
@@ -63,7 +64,7 @@ fp_language_grammar = Grammar(
         ("if", r"if"),
         ("else", r"else"),
         ("semicolon", r";"),
-        ("comparison_op", r"<|<=|==|!=|>=|>"),
+        ("comparison_op", r"<=|<|==|!=|>=|>"),
         ("assignment_op", r"="),
         ("add_op", r"\+|-"),
         ("mul_op", r"\*|/"),
@@ -71,7 +72,7 @@ fp_language_grammar = Grammar(
         ("rbrace", r"\)"),
         ("identifier", r"[a-zA-Z_]+"),
         ("int", r"0|[1-9][0-9]*"),
-        ("float", r"((0|[1-9][0-9]*)\.)|(\.[0-9]+)|((0|[1-9][0-9]*)\.[0-9]+)"),
+        ("float", r"(0|[1-9][0-9]*)\.[0-9]+|(0|[1-9][0-9]*)\.|\.[0-9]+"),
     ],
     productions=[
         ("Program", "Statements Expression"),
@@ -109,6 +110,9 @@ fp_language_grammar = Grammar(
         ("Factor", "float"),
     ],
     start_symbol="Program",
+    # `letter` is an identifier, `<=` one comparison_op
+    longest_match=True,
+    keywords={"let": "let", "if": "if", "else": "else"},
     examples={
         "application": "(x -> x - 1) 1",
         "statement": "let f = x -> x + 1; f 2",
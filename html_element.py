@@ -9,7 +9,8 @@ from string_writer import StringWriter
 class HtmlElement:
     name: str
     attributes: T.Dict[str, str] = field(default_factory=dict)
-    children: T.List["HtmlElement"] | str = field(default_factory=list)
+    # NOTE: may be a generator, which is consumed while compiling (i.e. only once)
+    children: T.Iterable["HtmlElement"] | str = field(default_factory=list)
 
     # fmt: off
     _void_elements = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr')
@@ -25,7 +26,8 @@ class HtmlElement:
         elif self.children:
             writer.write_line('>')
             with writer.indented():
-                writer.write(*self.children)
+                for child in self.children:
+                    writer.write(child)
             return writer.indent().write_line(f'</', self.name, '>')
         elif self.name in self._void_elements:
             return writer.write_line(' />')
@@ -9,26 +9,89 @@ if __name__ == "__main__":
     import argparse
     import sys
     import pickle
+    import json
+    from datetime import datetime
+    from results_store import ResultsStore
     argparser = argparse.ArgumentParser()
-    argparser.add_argument('--save-data')
-    argparser.add_argument('--load-data')
+    argparser.add_argument('--save-data', help='append the metrics to this results store (csv)')
+    argparser.add_argument('--save-trees', action='store_true', help='also keep the parse trees next to the store')
+    argparser.add_argument('--load-data', help='results store to report on (or a pickle from older versions)')
+    argparser.add_argument('--filter-grammar')
+    argparser.add_argument('--filter-example')
+    argparser.add_argument('--filter-parser', choices=['normal', 'memoized'])
+    argparser.add_argument('--since', type=datetime.fromisoformat, help='only runs recorded since (iso format)')
+    argparser.add_argument('--output', help='write the report to this file instead of stdout')
+    argparser.add_argument('--profile', action='store_true', help='add per nonterminal tables to the report')
+    argparser.add_argument('--profile-json', help='write per nonterminal stats of every run to this file')
+    argparser.add_argument('--sweep', action='store_true', help='benchmark generated sentences of growing size')
+    argparser.add_argument('--sweep-max-tokens', type=int, default=1_000_000)
+    argparser.add_argument('--sweep-budget', type=float, default=30.0, help='seconds allowed per cell')
+    argparser.add_argument('--sweep-seed', type=int, default=0)
+    argparser.add_argument('--workers', type=int, help='benchmark processes at a time (default: one per cpu)')
+    argparser.add_argument('--timeout', type=float, default=60.0, help='seconds before a benchmark cell is killed')
+    argparser.add_argument('--cpus', type=lambda s: [int(cpu) for cpu in s.split(',')], help='pin workers to these cpus, e.g. 0,2,3')
+    argparser.add_argument('--in-process', action='store_true', help='run the benchmarks one after another in this process')
     args = argparser.parse_args(sys.argv[1:])
 
-    if args.load_data is not None:
+    extra_content = []
+    profile = args.profile or args.profile_json is not None
+    if args.sweep:
+        from sweep import sweep, default_sizes, make_plot, make_summary
+        all_series = sweep(
+            [expression_grammar, bad_expression_grammar],
+            sizes=[size for size in default_sizes if size <= args.sweep_max_tokens],
+            seed=args.sweep_seed,
+            time_budget=args.sweep_budget,
+        )
+        stats = [stats for series in all_series for stats in series.stats]
+        extra_content = [
+            make_summary(all_series),
+            make_plot(all_series, "seconds", "parse time"),
+            make_plot(all_series, "peak_memory", "peak memory (bytes)"),
+        ]
+    elif args.load_data is not None and args.load_data.endswith('.pickle'):
         with open(args.load_data, 'rb') as f:
             stats = pickle.load(f)
+    elif args.load_data is not None:
+        stats = list(ResultsStore(args.load_data).load(
+            grammar_name=args.filter_grammar,
+            example_name=args.filter_example,
+            parser_type=args.filter_parser,
+            since=args.since,
+        ))
+    elif not args.in_process:
+        from matrix import cells, run_matrix
+        stats = run_matrix(
+            cells([bad_expression_grammar, expression_grammar]),
+            workers=args.workers,
+            timeout=args.timeout,
+            cpus=args.cpus,
+            profile=profile,
+        )
     else:
         stats = [
-            *[run(bad_expression_grammar, example_name) for example_name in bad_expression_grammar.examples.keys()],
-            *[run(bad_expression_grammar, example_name, parser_type="memoized") for example_name in bad_expression_grammar.examples.keys()],
-            *[run(expression_grammar, example_name) for example_name in expression_grammar.examples.keys()],
-            *[run(expression_grammar, example_name, parser_type="memoized") for example_name in expression_grammar.examples.keys()],
+            *[run(bad_expression_grammar, example_name, profile=profile) for example_name in bad_expression_grammar.examples.keys()],
+            *[run(bad_expression_grammar, example_name, parser_type="memoized", profile=profile) for example_name in bad_expression_grammar.examples.keys()],
+            *[run(expression_grammar, example_name, profile=profile) for example_name in expression_grammar.examples.keys()],
+            *[run(expression_grammar, example_name, parser_type="memoized", profile=profile) for example_name in expression_grammar.examples.keys()],
         ]
 
     if args.save_data is not None:
-        with open(args.save_data, 'wb') as f:
-            pickle.dump(stats, f)
+        ResultsStore(args.save_data).append(stats, save_trees=args.save_trees)
     
+    profiled_stats = [_stats for _stats in stats if getattr(_stats, 'profile', None) is not None]
+    if args.profile_json is not None:
+        with open(args.profile_json, 'w') as f:
+            json.dump([
+                {'grammar_name': _stats.grammar_name, 'example_name': _stats.example_name, 'parser_type': _stats.parser_type, **_stats.profile.to_dict()}
+                for _stats in profiled_stats
+            ], f, indent=2)
+    if args.profile:
+        extra_content += [
+            _stats.profile.make_table(caption=f'{_stats.grammar_name} {_stats.example_name} {_stats.parser_type}')
+            for _stats in profiled_stats
+        ]
+
     table = RunStats.make_table(stats)
     document = HtmlElement(
         "html",
@@ -40,11 +103,14 @@ if __name__ == "__main__":
                 ],
             ),
             HtmlElement("body", children=[
+                *extra_content,
                 table, 
                 HtmlElement("script", attributes={"src": "./script.js"}),
             ]),
         ],
     )
-    writer = StringWriter()
-    document.compile(writer)
-    print(writer)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            document.compile(StringWriter(f))
+    else:
+        document.compile(StringWriter(sys.stdout))
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import time
+import typing as T
+from dataclasses import dataclass
+from datetime import timedelta
+from multiprocessing.connection import Connection, wait
+
+import ast_codec
+from grammar import Grammar
+from grammar_registry import registry
+from run import RunStats, TParserType, run
+
+# (grammar, example name, parser type)
+TCell = T.Tuple[Grammar, str, TParserType]
+
+
+def cells(grammars: T.Sequence[Grammar], parser_types: T.Sequence[TParserType] = ("normal", "memoized")) -> T.List[TCell]:
+    """Every example of every grammar with every parser type, grouped like the report"""
+    return [
+        (grammar, example_name, parser_type)
+        for grammar in grammars
+        for parser_type in parser_types
+        for example_name in grammar.examples.keys()
+    ]
+
+
+def _run_cell(
+    connection: Connection,
+    grammar: Grammar,
+    example_name: str,
+    parser_type: TParserType,
+    profile: bool,
+    cpu: T.Optional[int],
+):
+    """Worker process body, sends (status, stats without the tree, encoded tree)"""
+    # NOTE: pinning is Linux only, elsewhere cells just aren't pinned
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    try:
+        stats = run(grammar, example_name, parser_type, profile=profile)
+    except Exception as e:
+        connection.send((f"error: {type(e).__name__}: {e}", None, None))
+        return
+    # NOTE: the codec costs about what pickle does, but it is iterative (pickle hits the
+    # recursion limit on deeply nested trees) and its encoding is smaller
+    tree = None if stats.result is None else ast_codec.dumps(stats.result)
+    stats.result = None
+    connection.send(("ok", stats, tree))
+
+
+def _failed(cell: TCell, status: str, elapsed: float) -> RunStats:
+    grammar, example_name, parser_type = cell
+    example = grammar.examples[example_name]
+    return RunStats(
+        grammar_name=grammar.name,
+        lexeme_count=sum(1 for _ in registry.lexer(grammar)(example)),
+        parser_type=parser_type,
+        result=None,
+        span=(0, 0),
+        example_name=example_name,
+        example=example,
+        timedelta=timedelta(seconds=elapsed),
+        total_calls=0,
+        status=status,
+    )
+
+
+@dataclass
+class _Running:
+    index: int
+    slot: int
+    process: T.Any  # a `multiprocessing` Process of the spawn context
+    started: float
+    deadline: T.Optional[float]
+
+
+def run_matrix(
+    matrix: T.Sequence[TCell],
+    workers: T.Optional[int] = None,
+    timeout: T.Optional[float] = None,
+    cpus: T.Optional[T.Sequence[int]] = None,
+    profile: bool = False,
+) -> T.List[RunStats]:
+    """Run each cell in a fresh interpreter, at most `workers` at a time
+
+    Cells share no state (parser registry, memo tables, the allocator), so one
+    can't skew another's timings.  A cell still running `timeout` seconds after
+    its process started (interpreter start up included) is killed and recorded
+    with status "timeout", a cell that raises or dies with status "error: ...".
+    With `cpus`, worker slot `i` is pinned to `cpus[i % len(cpus)]`, and there is
+    one worker per cpu unless `workers` says otherwise.  Results are in the order
+    of `matrix`.
+    """
+    if workers is None:
+        workers = len(cpus) if cpus else os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    results: T.List[T.Optional[RunStats]] = [None] * len(matrix)
+    pending = list(range(len(matrix)))[::-1]
+    free_slots = list(range(workers))[::-1]
+    running: T.Dict[Connection, _Running] = {}
+
+    def finish(receiver: Connection, stats: RunStats):
+        cell = running.pop(receiver)
+        cell.process.join()
+        receiver.close()
+        free_slots.append(cell.slot)
+        results[cell.index] = stats
+
+    while pending or running:
+        while pending and free_slots:
+            index, slot = pending.pop(), free_slots.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            cpu = cpus[slot % len(cpus)] if cpus else None
+            process = context.Process(target=_run_cell, args=(sender, *matrix[index], profile, cpu), daemon=True)
+            started = time.monotonic()
+            process.start()
+            sender.close()
+            running[receiver] = _Running(index, slot, process, started, None if timeout is None else started + timeout)
+
+        deadlines = [cell.deadline for cell in running.values() if cell.deadline is not None]
+        wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+        for receiver in wait(list(running), timeout=wait_for):
+            cell = running[receiver]
+            try:
+                status, stats, tree = receiver.recv()
+            except EOFError:
+                cell.process.join()
+                status, stats, tree = f"error: exit code {cell.process.exitcode}", None, None
+            if stats is None:
+                stats = _failed(matrix[cell.index], status, time.monotonic() - cell.started)
+            elif tree is not None:
+                stats.result = ast_codec.loads(tree)
+            finish(T.cast(Connection, receiver), stats)
+
+        now = time.monotonic()
+        for receiver, cell in list(running.items()):
+            if cell.deadline is not None and now >= cell.deadline:
+                cell.process.kill()
+                finish(receiver, _failed(matrix[cell.index], "timeout", now - cell.started))
+
+    return T.cast(T.List[RunStats], results)
+
+
+if __name__ == "__main__":
+    from grammars import bad_expression_grammar, expression_grammar
+
+    started = time.monotonic()
+    for stats in run_matrix(cells([bad_expression_grammar, expression_grammar]), timeout=5.0):
+        print(
+            f"{stats.grammar_name:24} {stats.example_name:12} {stats.parser_type:9} "
+            f"{stats.timedelta.total_seconds():9.4f}s {stats.total_calls:9} calls  {stats.status}"
+        )
+    print(f"{time.monotonic() - started:.1f}s in all")
@@ -7,33 +7,60 @@ Result = T.TypeVar("Result")
 CacheKey = T.TypeVar("CacheKey")
 
 
-def memoize(make_key: T.Callable[Params, CacheKey]) -> T.Callable[[T.Callable[Params, Result]], T.Callable[Params, Result]]:
-    cache: T.Dict[CacheKey, T.Union[Result, Exception]] = {}
-    stats: T.DefaultDict[str, int] = defaultdict(int)
+def memoize(
+    make_key: T.Callable[Params, T.Optional[CacheKey]],
+    max_size: T.Optional[int] = None,
+    cache: T.Optional[T.Dict[CacheKey, T.Any]] = None,
+    stats: T.Optional[T.DefaultDict[str, int]] = None,
+    cache_exceptions: bool = True,
+) -> T.Callable[[T.Callable[Params, Result]], T.Callable[Params, Result]]:
+    """Cache results (and exceptions) of a function by `make_key(*args, **kwargs)`
+
+    * a `None` key means the call can't be cached, it's passed straight through
+    * with `max_size` the least recently used entry is evicted once the cache is full
+    * `cache` and `stats` may be passed in, to share or reset them from outside
+    * without `cache_exceptions` only calls that return are cached, for exceptions
+      that say nothing about the arguments (cancellation, resource limits)
+    """
+    _cache: T.Dict[CacheKey, T.Union[Result, Exception]] = {} if cache is None else cache
+    _stats: T.DefaultDict[str, int] = defaultdict(int) if stats is None else stats
 
     def outer_wrapper(fn: T.Callable[Params, Result]) -> T.Callable[Params, Result]:
         @wraps(fn)
         def wrapped(*args: Params.args, **kwargs: Params.kwargs) -> Result:
             cache_key = make_key(*args, **kwargs)
-            if cache_key not in cache:
-                stats["cache_misses"] += 1
+            if cache_key is None:
+                _stats["uncacheable"] += 1
+                return fn(*args, **kwargs)
+            elif cache_key not in _cache:
+                _stats["cache_misses"] += 1
                 try:
                     result = fn(*args, **kwargs)
-                    cache[cache_key] = result
+                    _cache[cache_key] = result
                     return result
                 except Exception as e:
-                    cache[cache_key] = e
+                    if cache_exceptions:
+                        _cache[cache_key] = e
                     raise e
+                finally:
+                    if max_size is not None and len(_cache) > max_size:
+                        # NOTE: dicts keep insertion order, hits are moved to the end
+                        del _cache[next(iter(_cache))]
+                        _stats["evictions"] += 1
             else:
-                stats["cache_hits"] += 1
-                cached_result = cache[cache_key]
+                _stats["cache_hits"] += 1
+                cached_result = _cache[cache_key]
+                if max_size is not None:
+                    del _cache[cache_key]
+                    _cache[cache_key] = cached_result
                 if isinstance(cached_result, Exception):
-                    raise cached_result
+                    # NOTE: otherwise the traceback grows with every re-raise
+                    raise cached_result.with_traceback(None)
                 else:
                     return cached_result
 
-        setattr(wrapped, "cache", cache)
-        setattr(wrapped, "stats", stats)
+        setattr(wrapped, "cache", _cache)
+        setattr(wrapped, "stats", _stats)
         return wrapped
 
     return outer_wrapper
@@ -1,17 +1,61 @@
 import typing as T
 from ast_node import AstNode
 
-from common_types import TProduction
 from lexeme import Lexeme
+from parse_context import ParseContext
 from recursive_descent_parser import RecursiveDescentParser
-from memoize import memoize
 
 
 class MemoizedRecursiveDescentParser(RecursiveDescentParser):
-    def __init__(self, productions: T.List[TProduction], is_lexeme_name: T.Optional[T.Callable[[str], bool]] = None) -> None:
-        super().__init__(productions, is_lexeme_name)
-        # self._parse = memoize(lambda lexemes, target, index: (target, index))(self.parse)
-        self._parse = memoize(lambda self, lexemes, target, index: (target, index))(RecursiveDescentParser.parse)
-    
-    def parse(self, lexemes: T.List[Lexeme], target: str, index: int) -> AstNode:
-        return self._parse(self, lexemes, target, index)
+    """Packrat parsing, results are memoized on (target, index) in the `ParseContext`
+
+    With `memoized`, only those nonterminals are memoized (see
+    `grammar_analysis.analyze` for which ones are worth the memory).
+    """
+
+    memoized: T.Optional[T.FrozenSet[str]]
+
+    def __init__(self, *args, memoized: T.Optional[T.Collection[str]] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.memoized = None if memoized is None else frozenset(memoized)
+
+    def parse_or_none(
+        self, lexemes: T.List[Lexeme], target: str, index: int, context: ParseContext, raising: bool = False
+    ) -> T.Optional[AstNode]:
+        """Failures are memoized as None, `parse` raises a fresh `ParseException` for them"""
+        if self.memoized is not None and target not in self.memoized:
+            return RecursiveDescentParser.parse_or_none(self, lexemes, target, index, context, raising)
+        cache_key = (target, index)
+        if cache_key in context.memo:
+            context.cache_hits += 1
+            if context.profiler is not None:
+                context.profiler.memo_hit(target)
+            return context.memo[cache_key]
+        context.cache_misses += 1
+        result = RecursiveDescentParser.parse_or_none(self, lexemes, target, index, context, raising)
+        context.memo[cache_key] = result
+        return result
+
+if __name__ == "__main__":
+    import timeit
+    from grammars import bad_expression_grammar
+    from regex_lexer import RegexLexer
+
+    # failure signalling: every failed alternative raises, or returns None
+    lexer = RegexLexer(bad_expression_grammar.terminals)
+    for example_name in ["ugly_8", "ugly_12", "ugly_16"]:
+        lexemes = list(lexer(bad_expression_grammar.examples[example_name]))
+        for parser_class in (RecursiveDescentParser, MemoizedRecursiveDescentParser):
+            timings = []
+            for failures in ("exception", "sentinel"):
+                parser = parser_class(bad_expression_grammar.productions, failures=failures)
+                number = 1 if parser_class is RecursiveDescentParser else 100
+                seconds = timeit.repeat(
+                    lambda: parser.parse_with_context(lexemes, bad_expression_grammar.start_symbol), number=number, repeat=3
+                )
+                timings.append(min(seconds) / number)
+            total_calls = parser.parse_with_context(lexemes, bad_expression_grammar.start_symbol)[1].total_calls
+            print(
+                f"{example_name:8} {parser_class.__name__:32} {total_calls:8} calls  "
+                f"exception {timings[0]:.6f}s  sentinel {timings[1]:.6f}s  ({timings[0] / timings[1]:.2f}x)"
+            )
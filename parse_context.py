@@ -0,0 +1,40 @@
+import typing as T
+from dataclasses import dataclass, field
+
+from ast_node import AstNode
+from lexeme import Lexeme
+from parse_exception import ParseException
+
+if T.TYPE_CHECKING:
+    from parse_profiler import ParseProfiler
+
+
+@dataclass
+class ParseContext:
+    """All mutable state of one parse, so parsers can be shared between threads"""
+
+    lexemes: T.List[Lexeme]
+    total_calls: int = 0
+    # (target, index) -> node, or None for a failed parse
+    memo: T.Dict[T.Tuple[str, int], T.Optional[AstNode]] = field(default_factory=dict)
+    cache_hits: int = 0
+    cache_misses: int = 0
+    profiler: T.Optional["ParseProfiler"] = None
+    # called on every step, may raise to abandon the parse (see async_api)
+    checkpoint: T.Optional[T.Callable[[], None]] = None
+    # furthest index where a symbol failed to match, and the symbols expected there
+    furthest_index: int = -1
+    expected: T.Set[str] = field(default_factory=set)
+
+    def fail(self, index: int, symbol: str):
+        if index > self.furthest_index:
+            self.furthest_index = index
+            self.expected = {symbol}
+        elif index == self.furthest_index:
+            self.expected.add(symbol)
+
+    def error(self) -> ParseException:
+        """The furthest failure, the best guess at where the input is wrong"""
+        index = max(self.furthest_index, 0)
+        lexeme = self.lexemes[index] if index < len(self.lexemes) else None
+        return ParseException(index, lexeme, self.expected)
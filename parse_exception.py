@@ -1,2 +1,36 @@
+import typing as T
+
+from lexeme import Lexeme
+
+
 class ParseException(Exception):
-    pass
+    """A failed parse, located at the furthest position any production reached
+
+    Raised bare while backtracking (that's cheap, and caught right away), the
+    parser only fills in the location for the failure it reports.
+    """
+
+    index: T.Optional[int]
+    lexeme: T.Optional[Lexeme]
+    expected: T.FrozenSet[str]
+
+    def __init__(
+        self,
+        index: T.Optional[int] = None,
+        lexeme: T.Optional[Lexeme] = None,
+        expected: T.Iterable[str] = (),
+    ):
+        self.index = index
+        self.lexeme = lexeme
+        self.expected = frozenset(expected)
+        super().__init__(self.message if index is not None else "")
+
+    @property
+    def message(self) -> str:
+        expected = " | ".join(sorted(self.expected)) or "nothing"
+        if self.lexeme is None:
+            return f"expected {expected} at end of input"
+        where = f"lexeme {self.index}"
+        if self.lexeme.line is not None:
+            where += f", line {self.lexeme.line}, column {self.lexeme.column}"
+        return f"expected {expected} at {where}, got {self.lexeme.name} {self.lexeme.value!r}"
@@ -0,0 +1,146 @@
+import json
+import time
+import typing as T
+from collections import defaultdict
+from dataclasses import asdict, dataclass, fields
+
+from common_types import THead, TProduction
+from html_element import HtmlElement
+
+
+@dataclass
+class RuleStats:
+    attempts: int = 0
+    successes: int = 0
+    failures: int = 0
+    # tokens matched by a failed attempt, which have to be parsed again
+    backtracked_tokens: int = 0
+    # inclusive, but recursive activations are only counted once
+    cumulative_time: float = 0.0
+    memo_hits: int = 0
+
+
+class ParseProfiler:
+    """Opt-in per nonterminal and per production statistics for a parser
+
+    Pass an instance as `profiler` to `parse_with_context`.  Nothing is recorded
+    (and nothing is paid for) when the parse has no profiler.
+    """
+
+    nonterminals: T.DefaultDict[THead, RuleStats]
+    productions: T.DefaultDict[TProduction, RuleStats]
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self.nonterminals = defaultdict(RuleStats)
+        self.productions = defaultdict(RuleStats)
+        self._active: T.DefaultDict[T.Any, int] = defaultdict(int)
+
+    def start(self):
+        """Called as a parse starts: one abandoned by an exception (e.g. `Cancelled` from a
+        checkpoint) never exited the rules it was in, they'd stay active and untimed"""
+        self._active.clear()
+
+    def _enter(self, stats: RuleStats, key: T.Any) -> float:
+        stats.attempts += 1
+        self._active[key] += 1
+        return time.perf_counter()
+
+    def _exit(self, stats: RuleStats, key: T.Any, start_time: float, success: bool, consumed: int):
+        self._active[key] -= 1
+        if self._active[key] == 0:
+            stats.cumulative_time += time.perf_counter() - start_time
+        if success:
+            stats.successes += 1
+        else:
+            stats.failures += 1
+            stats.backtracked_tokens += consumed
+
+    def enter_nonterminal(self, head: THead) -> float:
+        return self._enter(self.nonterminals[head], head)
+
+    def exit_nonterminal(self, head: THead, start_time: float, success: bool, consumed: int = 0):
+        self._exit(self.nonterminals[head], head, start_time, success, consumed)
+
+    def enter_production(self, head: THead, body: str) -> float:
+        return self._enter(self.productions[(head, body)], (head, body))
+
+    def exit_production(self, head: THead, body: str, start_time: float, success: bool, consumed: int = 0):
+        self._exit(self.productions[(head, body)], (head, body), start_time, success, consumed)
+
+    def memo_hit(self, head: THead):
+        self.nonterminals[head].memo_hits += 1
+
+    def to_dict(self) -> T.Dict[str, T.Dict[str, T.Dict[str, T.Any]]]:
+        return {
+            "nonterminals": {head: asdict(stats) for head, stats in self.nonterminals.items()},
+            "productions": {f"{head} -> {body}": asdict(stats) for (head, body), stats in self.productions.items()},
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def make_table(self, caption: str = "") -> HtmlElement:
+        """Nonterminals followed by their productions, slowest first"""
+        _field_names = [f.name for f in fields(RuleStats)]
+
+        def make_tr(rule: str, stats: RuleStats, css_class: str) -> HtmlElement:
+            return HtmlElement(
+                "tr",
+                attributes={"class": css_class},
+                children=[
+                    HtmlElement("td", children=rule),
+                    *[
+                        HtmlElement("td", children=_format_stat(getattr(stats, _field_name)))
+                        for _field_name in _field_names
+                    ],
+                ],
+            )
+
+        rows = []
+        for head, stats in sorted(self.nonterminals.items(), key=lambda item: -item[1].cumulative_time):
+            rows.append(make_tr(head, stats, "nonterminal"))
+            for (_head, body), production_stats in self.productions.items():
+                if _head == head:
+                    rows.append(make_tr(f"  -> {body}", production_stats, "production"))
+
+        return HtmlElement(
+            "table",
+            children=[
+                *([HtmlElement("caption", children=caption)] if caption else []),
+                HtmlElement(
+                    "thead",
+                    children=[
+                        HtmlElement(
+                            "tr",
+                            children=[HtmlElement("th", children=_name) for _name in ["rule", *_field_names]],
+                        )
+                    ],
+                ),
+                HtmlElement("tbody", children=rows),
+            ],
+        )
+
+
+def _format_stat(item: T.Any) -> str:
+    if isinstance(item, float):
+        return f"{item:09.6f}"
+    else:
+        return str(item)
+
+
+if __name__ == "__main__":
+    from grammars import bad_expression_grammar
+    from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
+    from recursive_descent_parser import RecursiveDescentParser
+    from regex_lexer import RegexLexer
+
+    lexemes = list(RegexLexer(bad_expression_grammar.terminals)(bad_expression_grammar.examples["ugly_8"]))
+    for parser_class in (RecursiveDescentParser, MemoizedRecursiveDescentParser):
+        profiler = ParseProfiler()
+        parser = parser_class(bad_expression_grammar.productions)
+        parser.parse_with_context(lexemes, bad_expression_grammar.start_symbol, 0, profiler=profiler)
+        print(parser_class.__name__)
+        print(profiler.to_json(indent=2))
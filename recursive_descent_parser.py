@@ -1,14 +1,19 @@
 import logging
 import typing as T
+from bisect import bisect_left
 from collections import defaultdict
 from dataclasses import dataclass, field
 from functools import wraps
-from common_types import TProduction
+from common_types import TParseTable, TProduction
 
 from lexeme import Lexeme
-from ast_node import AstNode
+from ast_node import AstNode, production_id
+from parse_context import ParseContext
 from parse_exception import ParseException
 
+if T.TYPE_CHECKING:
+    from parse_profiler import ParseProfiler
+
 
 logging.basicConfig(level=logging.WARN)
 log = logging.getLogger(__name__)
@@ -21,51 +26,297 @@ class LenParseException(ParseException):
         self.node = node
 
 
+def _default_is_lexeme_name(s: str) -> bool:
+    return s[0].islower()
+
+
+def make_parse_table(productions: T.List[TProduction], is_lexeme_name: T.Callable[[str], bool] = _default_is_lexeme_name) -> TParseTable:
+    """Split every body once, instead of filtering the productions on every call"""
+    table: TParseTable = {}
+    for head, body in productions:
+        table.setdefault(head, []).append((body, tuple((symbol, is_lexeme_name(symbol)) for symbol in body.split())))
+    return table
+
+
+def chain_heads(table: TParseTable) -> T.FrozenSet[str]:
+    """Heads of right recursive operator chains, `Head -> Operand op Head`"""
+    return frozenset(
+        head
+        for head, bodies in table.items()
+        for _, symbols in bodies
+        if len(symbols) == 3 and symbols[1][1] and not symbols[0][1] and symbols[2][0] == head
+    )
+
+
 class RecursiveDescentParser:
+    """A grammar engine, the state of each parse lives in its `ParseContext`
+
+    Instances aren't modified after `__init__`, so one parser per grammar can be
+    shared by any number of threads.
+
+    Compact trees are built while parsing for the nonterminals in
+    * `inline`: a node with a single child is replaced by the child, so `1` is an
+      `int` leaf instead of `AddExpr -> MulExpr -> Factor -> int`
+    * `n_ary`: `Head -> Operand op Head` chains become one `n_ary` node,
+      `operand (op operand)*` (see `AstNode.n_ary`)
+    NOTE: inlined nodes are named after the child, match on shape rather than
+    `matches_production` when walking compact trees.
+
+    Failed alternatives are signalled by raising `ParseException` (`parse`), or
+    with `failures="sentinel"` by returning None (`parse_or_none`), which is much
+    cheaper when the grammar backtracks a lot.  Either way, callers only see the
+    one exception raised by `parse_with_context`.
+    """
+
     productions: T.List[TProduction]
     is_lexeme_name: T.Callable[[str], bool]
-    total_calls = 0
-    first_call = True
+    table: TParseTable
+    inline: T.FrozenSet[str]
+    n_ary: T.FrozenSet[str]
+    production_ids: T.Dict[TProduction, int]
+    failures: T.Literal["exception", "sentinel"]
 
-    def __init__(self, productions: T.List[TProduction], is_lexeme_name: T.Optional[T.Callable[[str], bool]] = None) -> None:
+    def __init__(
+        self,
+        productions: T.List[TProduction],
+        is_lexeme_name: T.Optional[T.Callable[[str], bool]] = None,
+        table: T.Optional[TParseTable] = None,
+        inline: T.Optional[T.Collection[str]] = None,
+        n_ary: T.Optional[T.Collection[str]] = None,
+        compact: bool = False,
+        failures: T.Literal["exception", "sentinel"] = "sentinel",
+    ) -> None:
+        """`compact` defaults `inline` and `n_ary` to every nonterminal"""
         self.productions = productions
-        self.is_lexeme_name = (lambda s: s[0].islower()) if is_lexeme_name is None else is_lexeme_name
-        self.reset()
-    
-    def reset(self):
-        self.total_calls = 0
-    
-    def parse(self, lexemes: T.List[Lexeme], target: str, index: int) -> AstNode:
-        if self.total_calls == 0:
-            for i,lexeme in enumerate(lexemes):
-                log.debug(f' [{i:3}] {lexeme.value}')
-        self.total_calls += 1
-        productions = [production for head, production in self.productions if head == target]
-        log.info(f"parse({target}, {index}, {lexemes[index]})")
-        for production in productions:
+        self.is_lexeme_name = _default_is_lexeme_name if is_lexeme_name is None else is_lexeme_name
+        self.table = make_parse_table(productions, self.is_lexeme_name) if table is None else table
+        everything = self.table.keys() if compact else ()
+        self.inline = frozenset(everything if inline is None else inline)
+        self.n_ary = frozenset(everything if n_ary is None else n_ary) & chain_heads(self.table)
+        self.failures = failures
+        self.production_ids = {(head, body): production_id(head, body) for head, bodies in self.table.items() for body, _ in bodies}
+
+    def make_node(
+        self,
+        target: str,
+        production: str,
+        symbols: T.Tuple[T.Tuple[str, bool], ...],
+        children: T.List[AstNode],
+        start: int,
+        lexemes: T.List[Lexeme],
+    ) -> AstNode:
+        if len(children) == 1 and target in self.inline:
+            return children[0]
+        elif target in self.n_ary and len(symbols) == 3 and symbols[1][1] and symbols[2][0] == target:
+            last = children[2]
+            if last.n_ary and last.name == target:
+                children = [*children[:2], *last.children]
+            # NOTE: the children are `operand (op operand)*` now, not the body of the production
+            return AstNode(target, children, None, start, children[-1].end, lexemes, n_ary=True)
+        return AstNode(target, children, None, start, children[-1].end, lexemes, production=self.production_ids[(target, production)])
+
+    def parse_with_context(
+        self,
+        lexemes: T.List[Lexeme],
+        target: str,
+        index: int = 0,
+        profiler: T.Optional["ParseProfiler"] = None,
+        checkpoint: T.Optional[T.Callable[[], None]] = None,
+    ) -> T.Tuple[AstNode, ParseContext]:
+        """Raises a `ParseException` located at the furthest failure"""
+        context = ParseContext(lexemes, profiler=profiler, checkpoint=checkpoint)
+        if profiler is not None:
+            profiler.start()
+        if log.isEnabledFor(logging.DEBUG):
+            for i, lexeme in enumerate(lexemes):
+                log.debug(f" [{i:3}] {lexeme.value}")
+        result = self._parse_or_none(lexemes, target, index, context)
+        if result is None:
+            raise context.error()
+        return result, context
+
+    def _parse_or_none(self, lexemes: T.List[Lexeme], target: str, index: int, context: ParseContext) -> T.Optional[AstNode]:
+        if self.failures == "sentinel":
+            return self.parse_or_none(lexemes, target, index, context)
+        try:
+            return self.parse(lexemes, target, index, context)
+        except ParseException:
+            return None
+
+    def parse_with_recovery(
+        self,
+        lexemes: T.List[Lexeme],
+        item: str,
+        final: str,
+        sync: T.Collection[str],
+        index: int = 0,
+        profiler: T.Optional["ParseProfiler"] = None,
+        checkpoint: T.Optional[T.Callable[[], None]] = None,
+    ) -> T.Tuple[T.List[AstNode], T.List[ParseException]]:
+        """Panic mode recovery, to report every syntax error in one pass
+
+        Parses `item`s while a `sync` terminal is ahead, then one `final` which has
+        to consume the rest of the input (e.g. `Statement`s ending with `semicolon`,
+        then the `Expression` of an fpLang program).  After a failed item the input
+        is skipped up to and including the first sync terminal from the furthest
+        failure, and parsing carries on from there.
+
+        Returns the nodes parsed and the errors found, in input order.
+        """
+        sync_indices = [i for i, lexeme in enumerate(lexemes) if lexeme.name in sync]
+        nodes: T.List[AstNode] = []
+        errors: T.List[ParseException] = []
+        if profiler is not None:
+            profiler.start()
+        while index < len(lexemes):
+            target = item if bisect_left(sync_indices, index) < len(sync_indices) else final
+            # NOTE: a fresh context, failed memo entries from a bad item would hide expected terminals
+            context = ParseContext(lexemes, profiler=profiler, checkpoint=checkpoint)
+            node = self._parse_or_none(lexemes, target, index, context)
+            if node is not None and target == item:
+                nodes.append(node)
+                index = node.end
+                continue
+            elif node is not None and node.end == len(lexemes):
+                nodes.append(node)
+                break
+            elif node is not None:
+                context.fail(node.end, "end of input")
+            errors.append(context.error())
+            resume = bisect_left(sync_indices, max(context.furthest_index, index))
+            if target == final or resume == len(sync_indices):
+                break
+            index = sync_indices[resume] + 1
+        return nodes, errors
+
+    def parse(self, lexemes: T.List[Lexeme], target: str, index: int, context: T.Optional[ParseContext] = None) -> AstNode:
+        if context is None:
+            return self.parse_with_context(lexemes, target, index)[0]
+        result = self.parse_or_none(lexemes, target, index, context, raising=True)
+        if result is None:
+            raise ParseException()
+        return result
+
+    def parse_or_none(
+        self, lexemes: T.List[Lexeme], target: str, index: int, context: ParseContext, raising: bool = False
+    ) -> T.Optional[AstNode]:
+        """`parse`, returning None instead of raising on failure
+
+        This is the engine loop shared by both failure engines.  With `raising`
+        (the exception engine, `parse`), a failed symbol raises `ParseException`
+        and nonterminals are parsed by `parse`, so a failed alternative unwinds
+        through the exception handler; otherwise they are parsed by `parse_or_none`
+        and a failed symbol just ends its alternative.
+        """
+        context.total_calls += 1
+        if context.checkpoint is not None:
+            context.checkpoint()
+        # NOTE: formatting the trace costs more than the parse itself, only do it when it is logged
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug(f"parse({target}, {index}, {lexemes[index] if index < len(lexemes) else 'end of input'})")
+        parse_child = self.parse if raising else self.parse_or_none
+        profiler = context.profiler
+        if profiler is not None:
+            nonterminal_start_time = profiler.enter_nonterminal(target)
+        for production, symbols in self.table.get(target, []):
             children: T.List[AstNode] = []
             _start = index
+            if profiler is not None:
+                production_start_time = profiler.enter_production(target, production)
+            # NOTE: try blocks are free until something is raised, the sentinel engine never does
             try:
-                for symbol in production.split():
-                    if index >= len(lexemes):
-                        raise ParseException()
-                    elif self.is_lexeme_name(symbol) and lexemes[index] == symbol:
-                        log.debug(f"  _LEXX {symbol} ({index})")
+                for symbol, is_lexeme in symbols:
+                    # NOTE: nonterminals are still called at the end of input, to record the terminals they expect
+                    if is_lexeme and index >= len(lexemes):
+                        context.fail(index, symbol)
+                        if raising:
+                            raise ParseException()
+                        break
+                    elif is_lexeme and lexemes[index] == symbol:
+                        if debug:
+                            log.debug(f"  _LEXX {symbol} ({index})")
                         children.append(AstNode(symbol, [], lexemes[index], index, index + 1, lexemes))
                         index += 1
-                    elif not self.is_lexeme_name(symbol):
-                        children.append(self.parse(lexemes=lexemes, target=symbol, index=index))
-                        index = children[-1].end
+                    elif not is_lexeme:
+                        child = parse_child(lexemes, symbol, index, context)
+                        if child is None:
+                            break
+                        children.append(child)
+                        index = child.end
                     elif symbol == "":
                         continue
                     else:
-                        log.debug(f"  _FAIL [sym:{index}] {target} ({production})")
-                        raise ParseException()
-                log.debug(f"--_SUCC {target} ({production})")
-                return AstNode(target, children, None, _start, children[-1].end, lexemes)
+                        if debug:
+                            log.debug(f"  _FAIL [sym:{index}] {target} ({production})")
+                        context.fail(index, symbol)
+                        if raising:
+                            raise ParseException()
+                        break
+                else:
+                    if debug:
+                        log.debug(f"--_SUCC {target} ({production})")
+                    if profiler is not None:
+                        profiler.exit_production(target, production, production_start_time, True)
+                        profiler.exit_nonterminal(target, nonterminal_start_time, True)
+                    return self.make_node(target, production, symbols, children, _start, lexemes)
             except ParseException:
+                pass
+            if debug:
                 log.debug(f"  _FAIL [pro:{index}] {target} ({production})")
-                children = []
-                index = _start
-        else:
-            raise ParseException()
+            if profiler is not None:
+                profiler.exit_production(target, production, production_start_time, False, index - _start)
+                profiler.nonterminals[target].backtracked_tokens += index - _start
+            index = _start
+        if profiler is not None:
+            profiler.exit_nonterminal(target, nonterminal_start_time, False)
+        return None
+
+
+if __name__ == "__main__":
+    from evaluate_expression import evaluate_expression
+    from fp_lang import evaluate_fp_program
+    from grammar_registry import registry
+    from grammars import expression_grammar, fp_language_grammar
+
+    def shape(node: AstNode) -> T.Tuple[int, int]:
+        """(node count, depth)"""
+        child_shapes = [shape(child) for child in node.children]
+        return 1 + sum(count for count, _ in child_shapes), 1 + max((depth for _, depth in child_shapes), default=0)
+
+    def compare(grammar, examples: T.Dict[str, str], evaluate: T.Callable[[AstNode], T.Any]):
+        for name, text in examples.items():
+            lexemes = list(registry.lexer(grammar)(text))
+            trees = [registry.parser(grammar, "memoized", compact).parse(lexemes, grammar.start_symbol, 0) for compact in (False, True)]
+            (count, depth), (compact_count, compact_depth) = map(shape, trees)
+            print(
+                f"{grammar.name} {name}: nodes {count} -> {compact_count}, depth {depth} -> {compact_depth}, "
+                f"value {evaluate(trees[0])} == {evaluate(trees[1])}"
+            )
+
+    values = {"x": 3, "y": 5, "z": 7}
+    compare(
+        expression_grammar,
+        {"int": "1", "sum": "x - y + z - 1", "mixed": "x * ( y - 2 ) * z + 4 / 2 - x"},
+        lambda node: evaluate_expression(node, lambda _node: values[T.cast(Lexeme, _node.lexeme).value]),
+    )
+    compare(fp_language_grammar, fp_language_grammar.examples, evaluate_fp_program)
+
+    broken_program = """
+        let f = x -> x + ;
+        let g = x -> (x * 2;
+        let h = x -> x - 1;
+        let = 3;
+        f (g (h 1)) +
+    """
+    lexemes = list(registry.lexer(fp_language_grammar)(broken_program))
+    try:
+        registry.parser(fp_language_grammar, "memoized").parse(lexemes, fp_language_grammar.start_symbol, 0)
+    except ParseException as e:
+        print(f"first error: {e}")
+    nodes, errors = registry.parser(fp_language_grammar, "memoized").parse_with_recovery(
+        lexemes, "Statement", "Expression", ("semicolon",)
+    )
+    print(f"recovered {[node.value for node in nodes]}")
+    for error in errors:
+        print(f"  {error}")
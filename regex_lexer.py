@@ -1,48 +1,179 @@
 import typing as T
+import mmap
 import re
 
 from lexeme import Lexeme
 from lexer_exception import LexerException
 
+# str, or anything `re` can match bytes patterns against (bytes, mmap, ...)
+TLexerInput = T.Union[str, bytes, bytearray, memoryview, mmap.mmap]
+
 
 class RegexLexer:
+    """Splits input into lexemes, by default the first terminal that matches wins
+
+    With `longest_match` the terminal matching the most input wins instead (the
+    first listed on a tie), so `<=` isn't lexed as `<` `=`.  Terminals named in
+    `keywords` (keyword -> terminal name) aren't matched at all, a
+    `keyword_terminal` lexeme (an identifier) whose value is a keyword is renamed
+    instead, so `let` is a keyword and `letter` an identifier.
+    """
+
+    terminals: T.List[T.Tuple[str, str]]
     matchers: T.List[T.Tuple[str, re.Pattern[str]]]
+    byte_matchers: T.List[T.Tuple[str, re.Pattern[bytes]]]
+    # tokens are only matched with at least this much input ahead (or at the end of
+    # the input), so a token crossing a chunk boundary is never cut short
+    lookahead: int
+    longest_match: bool
+    keywords: T.Dict[str, str]
+    keyword_terminal: str
+
+    def __init__(
+        self,
+        name_pattern_pairs: T.List[T.Tuple[str, str]],
+        lookahead: int = 1024,
+        longest_match: bool = False,
+        keywords: T.Optional[T.Mapping[str, str]] = None,
+        keyword_terminal: str = "identifier",
+    ):
+        self.keywords = dict(keywords or {})
+        self.keyword_terminal = keyword_terminal
+        keyword_names = set(self.keywords.values())
+        self.terminals = [(name, pattern) for name, pattern in name_pattern_pairs if name not in keyword_names]
+        self.matchers = [(name, re.compile(pattern)) for name, pattern in self.terminals]
+        self.byte_matchers = [(name, re.compile(pattern.encode())) for name, pattern in self.terminals]
+        self.lookahead = lookahead
+        self.longest_match = longest_match
+
+    def prepare(self, buffer: T.Any) -> T.Any:
+        """Whatever `match` wants precomputed per buffer (it changes as chunks arrive), nothing here"""
+        return None
+
+    def match(self, buffer: T.Any, i: int, prepared: T.Any = None) -> T.Optional[T.Tuple[str, int]]:
+        """(name, end) of the token at `buffer[i:]`"""
+        best: T.Optional[T.Tuple[str, int]] = None
+        for name, matcher in self.matchers if isinstance(buffer, str) else self.byte_matchers:
+            match = matcher.match(buffer, i)
+            if match is None:
+                continue
+            elif not self.longest_match:
+                return name, match.end()
+            elif best is None or match.end() > best[1]:
+                best = name, match.end()
+        return best
+
+    def __call__(self, text: TLexerInput) -> T.Generator[Lexeme, None, None]:
+        """Lex a str, or bytes-like input in place (e.g. an `mmap`, without copying it)"""
+        return self.lex_chunks(iter([text]))
 
-    def __init__(self, name_pattern_pairs: T.List[T.Tuple[str, str]]):
-        self.matchers = [(name, re.compile(pattern)) for name, pattern in name_pattern_pairs]
+    def lex_chunks(self, chunks: T.Iterator[T.AnyStr]) -> T.Generator[Lexeme, None, None]:
+        """Lex input arriving in pieces, only the unconsumed tail is kept in memory"""
+        first = next(chunks, None)
+        if first is None:
+            return
+        if isinstance(first, str):
+            newline: T.Any = "\n"
+            decode: T.Callable[[T.Any], str] = lambda matched: matched
+        else:
+            newline = b"\n"
+            decode = lambda matched: matched.decode()
 
-    def __call__(self, text: str) -> T.Generator[Lexeme, None, None]:
+        buffer: T.Any = first
+        prepared: T.Any = None
+        stale = True  # `prepared` is out of date
+        base = 0  # offset of buffer[0] in the whole input
         i = 0
         line = 0
         column = 0
+        eof = False
 
-        def update_position(matched: str):
-            nonlocal line, column
-            if "\n" not in matched:
-                column += len(matched)
+        def refill():
+            nonlocal buffer, stale, base, i, eof
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
             else:
-                lines = matched.split("\n")
-                line += len(lines) - 1
-                column = len(lines[-1])
-
-        text_length = len(text)
-        while i < text_length:
-            for name, matcher in self.matchers:
-                match = matcher.match(text, i)
-                if match is not None:
-                    matched = match[0]
-                    matched_length = len(matched)
-                    if name != 'ws':
-                        yield Lexeme(name, matched, i, i + matched_length, line, column)
-                    update_position(matched)
-                    i += matched_length
-                    break
+                buffer = buffer[i:] + chunk
+                stale = True
+                base += i
+                i = 0
+
+        while True:
+            if not eof and len(buffer) - i < self.lookahead:
+                refill()
+                continue
+            if i >= len(buffer):
+                break
+            if stale:
+                prepared = self.prepare(buffer)
+                stale = False
+            match = self.match(buffer, i, prepared)
+            if not eof and (match is None or match[1] == len(buffer)):
+                # the token may continue in the next chunk
+                refill()
+                continue
+            if match is None:
+                raise LexerException(f"failed at ({base + i}, line {line}, column {column}) {decode(buffer[i : i + 20])}")
+
+            name, end = match
+            matched = buffer[i:end]
+            matched_length = end - i
+            if name != "ws":
+                value = decode(matched)
+                if name == self.keyword_terminal:
+                    name = self.keywords.get(value, name)
+                yield Lexeme(name, value, base + i, base + i + matched_length, line, column)
+            newlines = matched.count(newline)
+            if newlines == 0:
+                column += matched_length
             else:
-                raise LexerException(f"failed at ({i}, line {line}, column {column}) {text[i:20]}")
+                line += newlines
+                column = matched_length - matched.rfind(newline) - 1
+            i += matched_length
+
+    def lex_file(
+        self,
+        path: str,
+        use_mmap: bool = True,
+        chunk_size: int = 1 << 20,
+        encoding: str = "utf-8",
+    ) -> T.Generator[Lexeme, None, None]:
+        """Lex a file without reading it into memory
+
+        With `use_mmap` the (ascii) patterns are matched against the mapped bytes, so
+        positions are byte offsets.  Otherwise the file is decoded `chunk_size`
+        characters at a time.
+        """
+        if use_mmap:
+            with open(path, "rb") as f:
+                try:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty files can't be mapped
+                    return
+                with mapped:
+                    yield from self(mapped)
+        else:
+            with open(path, encoding=encoding) as f:
+                yield from self.lex_chunks(iter(lambda: f.read(chunk_size), ""))
 
 
 if __name__ == "__main__":
-    lexer = RegexLexer([("ws", r"\s+"), ("int", r"\d+"), ("word", r"\w+")])
+    import timeit
     from pprint import pprint
+    from grammars import fp_language_grammar
 
+    lexer = RegexLexer([("ws", r"\s+"), ("int", r"\d+"), ("word", r"\w+")])
     pprint(list(lexer("This is 1 example")))
+
+    text = "let letter = x -> if (x <= 1) x else letter (x - 1); letter 3"
+    first_match = RegexLexer(fp_language_grammar.terminals)
+    keyword_lexer = RegexLexer(
+        fp_language_grammar.terminals, longest_match=True, keywords=fp_language_grammar.keywords
+    )
+    long_text = " ".join(fp_language_grammar.examples.values()) * 200
+    for name, _lexer in (("first match", first_match), ("longest match + keywords", keyword_lexer)):
+        print(f"{name}: {len(_lexer.matchers)} matchers")
+        print("  " + " ".join(f"{lexeme.name}:{lexeme.value}" for lexeme in _lexer(text)))
+        print(f"  {min(timeit.repeat(lambda: sum(1 for _ in _lexer(long_text)), number=1, repeat=3)):.4f}s")
@@ -0,0 +1,223 @@
+import csv
+import os
+import pickle
+import struct
+import typing as T
+from datetime import datetime, timedelta
+
+import ast_codec
+from ast_node import AstNode
+from run import RunStats
+
+# `.trees` files start with this, then hold (row number, size) headers each followed by an encoded tree
+_trees_magic = b"TREES\x00\x00\x01"
+_tree_record = struct.Struct("<II")
+
+# NOTE: scalar metrics only, `result` (and `profile`) hold the whole tree and lexeme list
+_columns = [
+    "recorded_at",
+    "grammar_name",
+    "example_name",
+    "parser_type",
+    "lexeme_count",
+    "span_start",
+    "span_end",
+    "seconds",
+    "total_calls",
+    "cache_hits",
+    "cache_misses",
+    "peak_memory",
+    "example",
+    "status",
+]
+_filter_columns = ("grammar_name", "example_name", "parser_type")
+
+# examples can be generated sentences with millions of tokens
+max_example_length = 200
+
+
+def _to_row(stats: RunStats, recorded_at: datetime) -> T.List[str]:
+    def _optional(value: T.Optional[int]) -> str:
+        return "" if value is None else str(value)
+
+    return [
+        recorded_at.isoformat(),
+        stats.grammar_name,
+        stats.example_name,
+        stats.parser_type,
+        str(stats.lexeme_count),
+        str(stats.span[0]),
+        str(stats.span[1]),
+        repr(stats.timedelta.total_seconds()),
+        str(stats.total_calls),
+        _optional(stats.cache_hits),
+        _optional(stats.cache_misses),
+        _optional(stats.peak_memory),
+        stats.example[:max_example_length],
+        stats.status,
+    ]
+
+
+def _from_row(row: T.List[str]) -> RunStats:
+    def _optional(value: str) -> T.Optional[int]:
+        return None if value == "" else int(value)
+
+    return RunStats(
+        grammar_name=row[1],
+        example_name=row[2],
+        parser_type=T.cast(T.Any, row[3]),
+        lexeme_count=int(row[4]),
+        result=None,
+        span=(int(row[5]), int(row[6])),
+        timedelta=timedelta(seconds=float(row[7])),
+        total_calls=int(row[8]),
+        cache_hits=_optional(row[9]),
+        cache_misses=_optional(row[10]),
+        peak_memory=_optional(row[11]),
+        example=row[12],
+        # NOTE: stores written before `status` have one column less
+        status=row[13] if len(row) > 13 else "ok",
+        recorded_at=datetime.fromisoformat(row[0]),
+    )
+
+
+class ResultsStore:
+    """Append-only csv of benchmark metrics, with parse trees optionally kept aside
+
+    Rows are written as runs finish, so a long (nightly) run loses nothing when it
+    is interrupted.  Trees go to `<path>.trees` encoded by `ast_codec`, each
+    behind its row number and size, and are only read when asked for (the
+    others are skipped without decoding).  Older stores of pickled
+    `(row number, AstNode)` pairs are still read.
+    """
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def trees_path(self) -> str:
+        return f"{self.path}.trees"
+
+    def _row_count(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, newline="") as f:
+            return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+    def _upgrade(self):
+        """Rewrite a store from before the `status` column with it (every old row is "ok")"""
+        with open(self.path, newline="") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != _columns[:-1]:
+                return
+            rows = [row if len(row) == len(_columns) else [*row, "ok"] for row in reader]
+        upgraded_path = f"{self.path}.upgrade"
+        with open(upgraded_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(_columns)
+            writer.writerows(rows)
+        os.replace(upgraded_path, self.path)
+
+    def append(self, run_stats: T.Iterable[RunStats], save_trees: bool = False, recorded_at: T.Optional[datetime] = None):
+        recorded_at = datetime.now() if recorded_at is None else recorded_at
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if not is_new:
+            self._upgrade()
+        row_number = 0 if is_new or not save_trees else self._row_count()
+        trees = open(self.trees_path, "ab") if save_trees else None
+        try:
+            if trees is not None:
+                if trees.tell() == 0:
+                    trees.write(_trees_magic)
+                elif not self._encoded_trees():
+                    raise Exception(f"[ResultsStore] {self.trees_path} holds pickled trees, convert it before appending")
+            with open(self.path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(_columns)
+                for stats in run_stats:
+                    writer.writerow(_to_row(stats, stats.recorded_at or recorded_at))
+                    if trees is not None and stats.result is not None:
+                        encoded = ast_codec.dumps(stats.result)
+                        trees.write(_tree_record.pack(row_number, len(encoded)))
+                        trees.write(encoded)
+                    row_number += 1
+                    f.flush()
+        finally:
+            if trees is not None:
+                trees.close()
+
+    def load(
+        self,
+        grammar_name: T.Optional[str] = None,
+        example_name: T.Optional[str] = None,
+        parser_type: T.Optional[str] = None,
+        since: T.Optional[datetime] = None,
+    ) -> T.Generator[RunStats, None, None]:
+        """Only rows passing the filters are converted to `RunStats`"""
+        filters = [
+            (_columns.index(column), value)
+            for column, value in zip(_filter_columns, (grammar_name, example_name, parser_type))
+            if value is not None
+        ]
+        # NOTE: iso timestamps compare like the datetimes they encode
+        _since = since.isoformat() if since is not None else None
+        with open(self.path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is not None and header not in (_columns, _columns[:-1]):
+                raise Exception(f"[ResultsStore] unexpected columns in {self.path}: {header}")
+            for row in reader:
+                if _since is not None and row[0] < _since:
+                    continue
+                if all(row[index] == value for index, value in filters):
+                    yield _from_row(row)
+
+    def _encoded_trees(self) -> bool:
+        with open(self.trees_path, "rb") as f:
+            return f.read(len(_trees_magic)) == _trees_magic
+
+    def load_trees(self, row_numbers: T.Optional[T.Set[int]] = None) -> T.Dict[int, AstNode]:
+        trees: T.Dict[int, AstNode] = {}
+        if not os.path.exists(self.trees_path):
+            return trees
+        if self._encoded_trees():
+            with open(self.trees_path, "rb") as f:
+                f.seek(len(_trees_magic))
+                while True:
+                    record = f.read(_tree_record.size)
+                    if len(record) < _tree_record.size:
+                        break
+                    row_number, size = _tree_record.unpack(record)
+                    if row_numbers is None or row_number in row_numbers:
+                        trees[row_number] = ast_codec.loads(f.read(size))
+                    else:
+                        f.seek(size, os.SEEK_CUR)
+            return trees
+        with open(self.trees_path, "rb") as f:
+            while True:
+                try:
+                    row_number, tree = pickle.load(f)
+                except EOFError:
+                    break
+                if row_numbers is None or row_number in row_numbers:
+                    trees[row_number] = tree
+        return trees
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    argparser = argparse.ArgumentParser(description="convert pickled RunStats (old --save-data files) to a results store")
+    argparser.add_argument("pickle_file")
+    argparser.add_argument("store")
+    argparser.add_argument("--save-trees", action="store_true")
+    args = argparser.parse_args(sys.argv[1:])
+
+    with open(args.pickle_file, "rb") as f:
+        stats = pickle.load(f)
+    ResultsStore(args.store).append(stats, save_trees=args.save_trees)
+    print(f"{args.pickle_file} ({os.path.getsize(args.pickle_file)} bytes) -> {args.store} ({os.path.getsize(args.store)} bytes)")
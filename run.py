@@ -1,17 +1,17 @@
 import typing as T
+import tracemalloc
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pprint import pprint, pformat
 from ast_node import AstNode
 from common_types import TProduction
 from grammar import Grammar
+from grammar_registry import registry
 from html_element import HtmlElement
 from lexeme import Lexeme
-from memoized_recursive_descent_parser import MemoizedRecursiveDescentParser
+from parse_profiler import ParseProfiler
 
-from recursive_descent_parser import RecursiveDescentParser
 from memoize import memoize
-from regex_lexer import RegexLexer
 
 TParserType = T.Literal["normal", "memoized"]
 
@@ -28,7 +28,8 @@ class RunStats:
     grammar_name: str
     lexeme_count: int
     parser_type: TParserType
-    result: AstNode
+    # NOTE: None when loaded from a `ResultsStore`, which keeps trees separately
+    result: T.Optional[AstNode]
     span: T.Tuple[int, int]
     example_name: str
     example: str
@@ -37,6 +38,11 @@ class RunStats:
 
     cache_hits: T.Optional[int] = None
     cache_misses: T.Optional[int] = None
+    peak_memory: T.Optional[int] = None
+    profile: T.Optional[ParseProfiler] = None
+    recorded_at: T.Optional[datetime] = None
+    # "ok", "timeout", or "error: <message>" for cells run by `matrix.run_matrix`
+    status: str = "ok"
 
     _table_fields = [
         "grammar_name",
@@ -48,6 +54,8 @@ class RunStats:
         "lexeme_count",
         "cache_misses",
         "cache_hits",
+        "peak_memory",
+        "status",
     ]
 
     def to_tr(self) -> HtmlElement:
@@ -81,7 +89,8 @@ class RunStats:
                 ),
                 HtmlElement(
                     "tbody",
-                    children=[
+                    # NOTE: rows are rendered lazily, so `run_stats` may be a stream of results
+                    children=(
                         stats.to_tr()
                         # HtmlElement(
                         #     "tr",
@@ -91,30 +100,43 @@ class RunStats:
                         #     ],
                         # )
                         for stats in run_stats
-                    ],
+                    ),
                 ),
             ],
         )
 
 
-def run(grammar: Grammar, example_name: str, parser_type: TParserType = "normal") -> RunStats:
-    lexer = RegexLexer(grammar.terminals)
+def run(
+    grammar: Grammar,
+    example_name: str,
+    parser_type: TParserType = "normal",
+    example: T.Optional[str] = None,
+    trace_memory: bool = False,
+    profile: bool = False,
+) -> RunStats:
+    """Parse `grammar.examples[example_name]`, or `example` if it is given (e.g. generated)"""
+    lexer = registry.lexer(grammar)
     # for name, text in grammar.examples.items():
-    example = grammar.examples[example_name]
+    if example is None:
+        example = grammar.examples[example_name]
     lexemes = list(lexer(example))
-    if parser_type == "memoized":
-        parser = MemoizedRecursiveDescentParser(grammar.productions)
-    else:
-        parser = RecursiveDescentParser(grammar.productions)
-
-    start_time = datetime.now()
-    result = parser.parse(lexemes, grammar.start_symbol, 0)
-    finish_time = datetime.now()
+    profiler = ParseProfiler() if profile else None
+    parser = registry.parser(grammar, parser_type)
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        start_time = datetime.now()
+        result, context = parser.parse_with_context(lexemes, grammar.start_symbol, 0, profiler=profiler)
+        finish_time = datetime.now()
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
 
     if parser_type == "memoized":
-        _stats: T.Dict[str, int] = getattr(getattr(parser, "_parse"), "stats")
-        cache_hits = _stats["cache_hits"]
-        cache_misses = _stats["cache_misses"]
+        cache_hits = context.cache_hits
+        cache_misses = context.cache_misses
     else:
         cache_hits = None
         cache_misses = None
@@ -128,9 +150,11 @@ def run(grammar: Grammar, example_name: str, parser_type: TParserType = "normal"
         result=result,
         span=(result.start, result.end),
         timedelta=finish_time - start_time,
-        total_calls=parser.total_calls,
+        total_calls=context.total_calls,
         cache_hits=cache_hits,
         cache_misses=cache_misses,
+        peak_memory=peak_memory,
+        profile=profiler,
     )
     # split_time = datetime.now()
     # results.append(memoized_parser.parse(lexemes, grammar.start_symbol, 0))
@@ -0,0 +1,188 @@
+import operator
+import typing as T
+from dataclasses import replace
+
+from ast_node import AstNode, production_of
+from lexeme import Lexeme
+
+_arithmetic_op_table = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+}
+
+_comparison_op_table = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
+
+_constant_names = ("int", "float", "bool")
+_chain_names = ("AddExpr", "MulExpr")
+_braced_names = ("BracedExpression", "Factor")
+
+Constant = T.Union[int, float, bool]
+
+
+def constant_value(node: AstNode) -> T.Optional[Constant]:
+    if node.lexeme is None or node.lexeme.name not in _constant_names:
+        return None
+    elif node.lexeme.name == "int":
+        return int(node.lexeme.value)
+    elif node.lexeme.name == "float":
+        return float(node.lexeme.value)
+    else:
+        return node.lexeme.value == "True"
+
+
+def make_constant(value: Constant, first_node: AstNode, last_node: T.Optional[AstNode] = None) -> AstNode:
+    """A leaf standing in for `first_node` .. `last_node`, with a synthesized lexeme holding `value`"""
+    last_node = last_node or first_node
+    if isinstance(value, bool):
+        name = "bool"
+    elif isinstance(value, int):
+        name = "int"
+    else:
+        name = "float"
+    first = first_node.lexemes[first_node.start]
+    last = last_node.lexemes[last_node.end - 1]
+    lexeme = Lexeme(name, repr(value), first.start, last.end, first.line, first.column)
+    return AstNode(name, [], lexeme, first_node.start, last_node.end, first_node.lexemes)
+
+
+def _chain(node: AstNode) -> T.Tuple[T.List[AstNode], T.List[AstNode]]:
+    """Operands and operator nodes of a (right recursive or n-ary) operator chain"""
+    if node.n_ary:
+        return node.children[0::2], node.children[1::2]
+    operands: T.List[AstNode] = []
+    ops: T.List[AstNode] = []
+    while True:
+        operands.append(node.children[0])
+        ops.append(node.children[1])
+        rest = node.children[2]
+        if rest.name == node.name and len(rest.children) == 3 and not rest.n_ary:
+            node = rest
+        else:
+            operands.append(rest)
+            return operands, ops
+
+
+def _is_chain(node: AstNode) -> bool:
+    return node.name in _chain_names and (
+        node.n_ary or (len(node.children) == 3 and node.children[1].lexeme is not None)
+    )
+
+
+def _is_braced(node: AstNode) -> bool:
+    return (
+        node.name in _braced_names
+        and len(node.children) == 3
+        and node.children[0].name == "lbrace"
+        and node.children[2].name == "rbrace"
+    )
+
+
+def _with_children(node: AstNode, children: T.List[AstNode]) -> AstNode:
+    production = node.production
+    if production >= 0 and [child.name for child in children] != production_of(production)[1].split():
+        production = -1
+    return replace(node, children=children, production=production)
+
+
+def simplify(node: AstNode) -> AstNode:
+    """Return a smaller tree, with the same value for `evaluate_expression` and `evaluate_fp_program`
+
+    * unit productions (a single child, e.g. `AddExpr -> MulExpr -> Factor -> int`)
+      are replaced by their child
+    * braces (`BracedExpression` and `Factor -> lbrace AddExpr rbrace`) are dropped,
+      the tree already encodes the grouping
+    * operator chains become flat `n_ary` nodes, and their leading constant operands
+      are folded (operators are left-associative, so only a prefix can be folded)
+    * comparisons of constants, and if-else expressions with a constant condition,
+      are folded
+    Nodes whose children no longer spell the body of their production (a unit
+    child was replaced, a chain flattened) lose their production id (-1).
+    """
+    if node.lexeme is not None:
+        return node
+    elif len(node.children) == 1:
+        return simplify(node.children[0])
+    elif _is_braced(node):
+        return simplify(node.children[1])
+    elif _is_chain(node):
+        operands, ops = _chain(node)
+        operands = [simplify(operand) for operand in operands]
+        acc = constant_value(operands[0])
+        folded = 0
+        while acc is not None and folded < len(ops):
+            rhs = constant_value(operands[folded + 1])
+            if rhs is None:
+                break
+            try:
+                acc = _arithmetic_op_table[T.cast(Lexeme, ops[folded].lexeme).value](acc, rhs)
+            except ArithmeticError:
+                # e.g. division by zero, left for the evaluator to report
+                break
+            folded += 1
+        if folded:
+            operands = [make_constant(T.cast(Constant, acc), operands[0], operands[folded]), *operands[folded + 1 :]]
+            ops = ops[folded:]
+        if not ops:
+            return operands[0]
+        children = [operands[0]]
+        for op, operand in zip(ops, operands[1:]):
+            children += [op, operand]
+        return AstNode(node.name, children, None, node.start, node.end, node.lexemes, n_ary=True)
+    elif node.name == "ComparisonExpression":
+        lhs, op, rhs = simplify(node.children[0]), node.children[1], simplify(node.children[2])
+        lhs_value, rhs_value = constant_value(lhs), constant_value(rhs)
+        if lhs_value is not None and rhs_value is not None:
+            return make_constant(_comparison_op_table[T.cast(Lexeme, op.lexeme).value](lhs_value, rhs_value), node)
+        return _with_children(node, [lhs, op, rhs])
+    elif node.name == "IfElseExpression":
+        children = [simplify(child) for child in node.children]
+        condition = constant_value(children[2])
+        if isinstance(condition, bool):
+            return children[4] if condition else children[6]
+        return _with_children(node, children)
+    elif node.name == "Application":
+        function_identifier, args = simplify(node.children[0]), simplify(node.children[1])
+        if args.name == "Application" and node.children[1].name != "Application":
+            # `f (g x)` must not become the curried `f g x`, keep a unit node in between
+            args = AstNode("Args", [args], None, args.start, args.end, args.lexemes)
+        return _with_children(node, [function_identifier, args])
+    else:
+        return _with_children(node, [simplify(child) for child in node.children])
+
+
+def count_nodes(node: AstNode) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children)
+
+
+if __name__ == "__main__":
+    from evaluate_expression import evaluate_expression
+    from fp_lang import evaluate_fp_program
+    from grammar_registry import registry
+    from grammars import expression_grammar, fp_language_grammar
+    from util import print_node
+
+    values = {"x": 3, "y": 5, "z": 7}
+    for text in ["2 * 3 + x", "x - 2 + 3", "1 + 2 + x * ( 4 / 2 ) - ( 1 - 1 )", "x - ( y + z ) * 2 * 3"]:
+        lexemes = list(registry.lexer(expression_grammar)(text))
+        root_node = registry.parser(expression_grammar, "memoized").parse(lexemes, expression_grammar.start_symbol, 0)
+        simplified = simplify(root_node)
+        handler = lambda node: values[T.cast(Lexeme, node.lexeme).value]
+        print(f"{text}: {count_nodes(root_node)} -> {count_nodes(simplified)} nodes, "
+              f"{evaluate_expression(root_node, handler)} == {evaluate_expression(simplified, handler)}")
+        print_node(simplified)
+
+    for name, text in fp_language_grammar.examples.items():
+        lexemes = list(registry.lexer(fp_language_grammar)(text))
+        root_node = registry.parser(fp_language_grammar, "memoized").parse(lexemes, fp_language_grammar.start_symbol, 0)
+        simplified = simplify(root_node)
+        print(f"{name}: {count_nodes(root_node)} -> {count_nodes(simplified)} nodes, "
+              f"{evaluate_fp_program(root_node)} == {evaluate_fp_program(simplified)}")
@@ -3,8 +3,14 @@ import typing as T
 from contextlib import contextmanager
 
 class StringWriter:
-    def __init__(self):
-        self.s = ""
+    """Collects fragments in a list, or passes them straight on to `sink`
+
+    With a sink (e.g. an open file or `sys.stdout`) nothing is kept in memory.
+    """
+
+    def __init__(self, sink: T.Optional[T.TextIO] = None):
+        self.sink = sink
+        self._fragments: T.List[str] = []
         self._indent = 0
     
     def write(self, *args: T.Any) -> 'StringWriter':
@@ -12,7 +18,10 @@ class StringWriter:
             if arg is None:
                 continue
             elif isinstance(arg, (str, int, datetime.timedelta)):
-                self.s += str(arg)
+                if self.sink is not None:
+                    self.sink.write(str(arg))
+                else:
+                    self._fragments.append(str(arg))
             elif hasattr(arg, 'compile'):
                 getattr(arg, 'compile')(self)
             else:
@@ -34,4 +43,8 @@ class StringWriter:
             self._indent -= 1
     
     def __str__(self) -> str:
-        return self.s
\ No newline at end of file
+        if self.sink is not None:
+            raise Exception("[__str__]: output was written to the sink")
+        if len(self._fragments) > 1:
+            self._fragments = ["".join(self._fragments)]
+        return self._fragments[0] if self._fragments else ""
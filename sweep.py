@@ -0,0 +1,227 @@
+import math
+import sys
+import threading
+import typing as T
+from dataclasses import dataclass, field
+
+from grammar import Grammar
+from html_element import HtmlElement
+from parse_exception import ParseException
+from run import RunStats, TParserType, run
+from workload_generator import WorkloadGenerator
+
+# 1-2-5 steps, so exponential growth is noticed before a cell runs away
+default_sizes = [m * 10**e for e in range(1, 7) for m in (1, 2, 5)][:-2]
+
+_colors = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b"]
+
+
+@dataclass
+class SweepSeries:
+    grammar_name: str
+    parser_type: TParserType
+    stats: T.List[RunStats] = field(default_factory=list)
+    stopped: T.Optional[str] = None
+    # (tokens, seconds) of the tracemalloc runs, which are much slower
+    traced_points: T.List[T.Tuple[float, float]] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        return f"{self.grammar_name} {self.parser_type}"
+
+    def points(self, metric: str) -> T.List[T.Tuple[float, float]]:
+        return [(s.lexeme_count, _metric(s, metric)) for s in self.stats if getattr(s, metric, 0) is not None]
+
+    def growth(self) -> str:
+        """Rough classification from the log-log slopes of the measured times"""
+        points = [(n, t) for n, t in self.points("seconds") if t > 0]
+        if len(points) < 2:
+            return "unknown"
+        slopes = [
+            math.log(t2 / t1) / math.log(n2 / n1)
+            for (n1, t1), (n2, t2) in zip(points, points[1:])
+            if n2 > n1
+        ]
+        last = slopes[-1]
+        if last > 3 and (len(slopes) == 1 or last > 1.5 * slopes[0]):
+            return f"exponential (slope {last:.1f} and rising)"
+        elif last < 1.3:
+            return f"linear (slope {last:.2f})"
+        else:
+            return f"polynomial (~n^{last:.1f})"
+
+
+def _metric(stats: RunStats, metric: str) -> float:
+    if metric == "seconds":
+        return max(stats.timedelta.total_seconds(), 1e-6)
+    else:
+        return float(getattr(stats, metric) or 0)
+
+
+def _run_with_deep_stack(fn: T.Callable[[], RunStats], stack_size: int, recursion_limit: int) -> RunStats:
+    """The parsers recurse once per nonterminal, so big inputs need a big stack"""
+    result: T.List[RunStats] = []
+    errors: T.List[BaseException] = []
+
+    def target():
+        try:
+            result.append(fn())
+        except BaseException as e:
+            errors.append(e)
+
+    old_limit = sys.getrecursionlimit()
+    old_stack_size = threading.stack_size(stack_size)
+    sys.setrecursionlimit(recursion_limit)
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(old_stack_size)
+        sys.setrecursionlimit(old_limit)
+    if errors:
+        raise errors[0]
+    return result[0]
+
+
+def _extrapolate(points: T.List[T.Tuple[float, float]], size: int) -> float:
+    """Extrapolate from the last two points, assuming exponential growth once the
+    log-log slope is steeper than cubic"""
+    if len(points) < 2:
+        return 0
+    (n1, t1), (n2, t2) = points[-2:]
+    if n2 <= n1:
+        return t2
+    slope = math.log(t2 / t1) / math.log(n2 / n1)
+    if slope > 3:
+        return t2 * (t2 / t1) ** ((size - n2) / (n2 - n1))
+    return t2 * (size / n2) ** max(slope, 1)
+
+
+def sweep(
+    grammars: T.Sequence[Grammar],
+    parser_types: T.Sequence[TParserType] = ("normal", "memoized"),
+    sizes: T.Sequence[int] = default_sizes,
+    seed: int = 0,
+    time_budget: float = 30.0,
+    trace_memory: bool = True,
+    stack_size: int = 512 * 1024 * 1024,
+    recursion_limit: int = 10**7,
+) -> T.List[SweepSeries]:
+    """Run every parser type over generated sentences of increasing size
+
+    A series is stopped once a cell is predicted to take longer than `time_budget`
+    seconds, or when a cell fails (e.g. `RecursionError`, `MemoryError`, or a
+    `ParseException` for sentences the ordered-choice parsers don't accept).
+    """
+    all_series = []
+    for grammar in grammars:
+        generator = WorkloadGenerator(grammar)
+        sentences = {}
+        for parser_type in parser_types:
+            series = SweepSeries(grammar.name, parser_type)
+            all_series.append(series)
+            for size in sizes:
+                predicted = _extrapolate(series.points("seconds"), size)
+                if predicted > time_budget:
+                    series.stopped = f"at {size} tokens, predicted {predicted:.3g}s > {time_budget}s"
+                    break
+                if size not in sentences:
+                    sentences[size] = generator.generate(target_tokens=size, seed=seed)
+                example_name = f"generated_{size}"
+                try:
+                    stats = _run_with_deep_stack(
+                        lambda: run(grammar, example_name, parser_type, example=sentences[size]),
+                        stack_size,
+                        recursion_limit,
+                    )
+                    # NOTE: separate run, tracemalloc walks the whole stack on every allocation,
+                    # which is quadratic for deep parses, so it gets its own budget
+                    if trace_memory and _extrapolate(series.traced_points, size) <= time_budget:
+                        traced = _run_with_deep_stack(
+                            lambda: run(grammar, example_name, parser_type, example=sentences[size], trace_memory=True),
+                            stack_size,
+                            recursion_limit,
+                        )
+                        stats.peak_memory = traced.peak_memory
+                        series.traced_points.append((traced.lexeme_count, _metric(traced, "seconds")))
+                except (RecursionError, MemoryError, ParseException) as e:
+                    series.stopped = f"at {size} tokens: {type(e).__name__}"
+                    break
+                series.stats.append(stats)
+    return all_series
+
+
+def make_plot(
+    all_series: T.List[SweepSeries],
+    metric: str,
+    title: str,
+    width: int = 640,
+    height: int = 400,
+    margin: int = 48,
+) -> HtmlElement:
+    """Log-log line plot as an inline svg"""
+    points = [p for series in all_series for p in series.points(metric) if p[1] > 0]
+    if not points:
+        return HtmlElement("p", children=f"{title}: no data")
+    x_min, x_max = (math.log10(f(p[0] for p in points)) for f in (min, max))
+    y_min, y_max = (math.log10(f(p[1] for p in points)) for f in (min, max))
+    x_span = max(x_max - x_min, 1e-9)
+    y_span = max(y_max - y_min, 1e-9)
+
+    def to_svg(x: float, y: float) -> str:
+        sx = margin + (math.log10(x) - x_min) / x_span * (width - 2 * margin)
+        sy = height - margin - (math.log10(y) - y_min) / y_span * (height - 2 * margin)
+        return f"{sx:.1f},{sy:.1f}"
+
+    children: T.List[HtmlElement] = [
+        HtmlElement("text", {"x": str(margin), "y": str(margin // 2)}, f"{title} (log-log)"),
+        HtmlElement("text", {"x": str(margin), "y": str(height - margin // 4)}, f"tokens 10^{x_min:.1f} .. 10^{x_max:.1f}"),
+        HtmlElement("text", {"x": str(width // 2), "y": str(height - margin // 4)}, f"{metric} 10^{y_min:.1f} .. 10^{y_max:.1f}"),
+    ]
+    for i, series in enumerate(all_series):
+        color = _colors[i % len(_colors)]
+        _points = [p for p in series.points(metric) if p[1] > 0]
+        if not _points:
+            continue
+        children.append(
+            HtmlElement(
+                "polyline",
+                {"points": " ".join(to_svg(*p) for p in _points), "fill": "none", "stroke": color, "stroke-width": "2"},
+            )
+        )
+        children.append(HtmlElement("text", {"x": str(width - 3 * margin), "y": str(margin + 16 * i), "fill": color}, series.label))
+    return HtmlElement("svg", {"width": str(width), "height": str(height), "xmlns": "http://www.w3.org/2000/svg"}, children)
+
+
+def make_summary(all_series: T.List[SweepSeries]) -> HtmlElement:
+    return HtmlElement(
+        "table",
+        children=[
+            HtmlElement("thead", children=[HtmlElement("tr", children=[HtmlElement("th", children=h) for h in ("series", "max tokens", "growth", "stopped")])]),
+            HtmlElement(
+                "tbody",
+                children=[
+                    HtmlElement(
+                        "tr",
+                        children=[
+                            HtmlElement("td", children=series.label),
+                            HtmlElement("td", children=max([s.lexeme_count for s in series.stats], default=0)),
+                            HtmlElement("td", children=series.growth()),
+                            HtmlElement("td", children=series.stopped or "-"),
+                        ],
+                    )
+                    for series in all_series
+                ],
+            ),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    from grammars import expression_grammar, bad_expression_grammar
+
+    for series in sweep([expression_grammar, bad_expression_grammar], sizes=default_sizes[:7], time_budget=2):
+        print(f"{series.label}: {series.growth()} {series.stopped or ''}")
+        for stats in series.stats:
+            print(f"  {stats.lexeme_count:8} {stats.timedelta} {stats.peak_memory}")
@@ -0,0 +1,101 @@
+import typing as T
+
+from ast_node import AstNode, production_id
+
+R = T.TypeVar("R")
+THandler = T.Callable[..., R]
+
+
+class Dispatcher(T.Generic[R]):
+    """Handler table for tree consumers, instead of `if node.name == ...` chains
+
+    A node's handler is looked up by the id of the production that built it, then
+    by its name, then `default`.  Productions are given as (head, body) and
+    interned once, when the table is built.
+    """
+
+    by_production: T.Dict[int, THandler]
+    by_name: T.Dict[str, THandler]
+    default: T.Optional[THandler]
+
+    def __init__(
+        self,
+        by_name: T.Optional[T.Mapping[str, THandler]] = None,
+        by_production: T.Optional[T.Mapping[T.Tuple[str, str], THandler]] = None,
+        default: T.Optional[THandler] = None,
+    ):
+        self.by_name = dict(by_name or {})
+        self.by_production = {production_id(head, body): handler for (head, body), handler in (by_production or {}).items()}
+        self.default = self._missing if default is None else default
+
+    @staticmethod
+    def _missing(node: AstNode, *args):
+        raise KeyError(f"[Dispatcher] no handler for {node.name}")
+
+    def lookup(self, node: AstNode) -> THandler:
+        if self.by_production:
+            handler = self.by_production.get(node.production)
+            if handler is not None:
+                return handler
+        return self.by_name.get(node.name, self.default)
+
+    def __call__(self, node: AstNode, *args) -> R:
+        return self.lookup(node)(node, *args)
+
+
+def _children(node: AstNode) -> T.Sequence[AstNode]:
+    return node.children
+
+
+def walk(root: AstNode, children: T.Callable[[AstNode], T.Sequence[AstNode]] = _children) -> T.Iterator[T.Tuple[AstNode, int]]:
+    """Pre-order (node, depth) pairs, without recursion"""
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        stack.extend((child, depth + 1) for child in reversed(children(node)))
+
+
+def _table(handlers: T.Callable[..., T.Any]) -> T.Tuple[T.Mapping[str, THandler], THandler]:
+    """(by name, default) for `by_name.get(node.name, default)`, which costs no Python call
+
+    A plain function is its own default, a `Dispatcher` keyed by production does its own lookup.
+    """
+    if isinstance(handlers, Dispatcher) and not handlers.by_production:
+        return handlers.by_name, handlers.default
+    return {}, handlers
+
+
+def fold(
+    root: AstNode,
+    combine: T.Callable[..., R],
+    children: T.Callable[[AstNode], T.Sequence[AstNode]] = _children,
+    *args,
+) -> R:
+    """Bottom-up fold without recursion, `combine(node, [results of children(node)], *args)`
+
+    `children` picks what is folded, e.g. the operands of an operator chain, or
+    nothing for a subtree `combine` handles itself.  Both can be `Dispatcher`s.
+    Leaves are combined right away, `children` isn't asked about them.
+    """
+    combine_by_name, combine_default = _table(combine)
+    children_by_name, children_default = _table(children)
+    results: T.List[R] = []
+    # (node, None) is a node still to expand, (node, children) one ready to combine
+    stack: T.List[T.Tuple[AstNode, T.Optional[T.Sequence[AstNode]]]] = [(root, None)]
+    while stack:
+        node, node_children = stack.pop()
+        if node_children is None:
+            if node.children:
+                node_children = children_by_name.get(node.name, children_default)(node)
+            if not node_children:
+                results.append(combine_by_name.get(node.name, combine_default)(node, [], *args))
+                continue
+            stack.append((node, node_children))
+            stack.extend([(child, None) for child in reversed(node_children)])
+        else:
+            split = len(results) - len(node_children)
+            values = results[split:]
+            del results[split:]
+            results.append(combine_by_name.get(node.name, combine_default)(node, values, *args))
+    return results[0]
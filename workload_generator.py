@@ -0,0 +1,172 @@
+import random
+import typing as T
+from collections import defaultdict
+
+from common_types import THead
+from grammar import Grammar
+
+# NOTE: sample values are chosen so that they lex back to the same terminal with
+# the grammars in `grammars.py` (e.g. no identifiers starting with `let` or `if`)
+_default_samples: T.Dict[str, T.List[str]] = {
+    "add_op": ["+", "-"],
+    "mul_op": ["*", "/"],
+    "lbrace": ["("],
+    "rbrace": [")"],
+    "var": ["x", "y", "z"],
+    "identifier": ["x", "y", "f", "n"],
+    "int": ["0", "1", "2", "42"],
+    # NOTE: `int` is listed before `float`, without `longest_match` these lex as two lexemes
+    "float": ["1.5", "2.25"],
+    "right_arrow": ["->"],
+    "let": ["let"],
+    "if": ["if"],
+    "else": ["else"],
+    "semicolon": [";"],
+    "comparison_op": ["<", "<=", "==", "!=", ">=", ">"],
+    "assignment_op": ["="],
+}
+
+
+class WorkloadGenerator:
+    """Generate random sentences of a grammar with a (roughly) given number of tokens
+
+    While the token budget is not exhausted productions are chosen at random, but at
+    least one recursive nonterminal is kept pending so the sentence keeps growing.
+    Once the budget (or `max_depth`) is reached every nonterminal is closed with its
+    shortest derivation, so the overshoot is bounded by the pending symbols.
+    """
+
+    grammar: Grammar
+    samples: T.Dict[str, T.List[str]]
+    min_tokens: T.Dict[str, int]
+    closing_production: T.Dict[THead, T.List[str]]
+    recursive: T.Set[THead]
+
+    def __init__(self, grammar: Grammar, samples: T.Optional[T.Dict[str, T.List[str]]] = None) -> None:
+        self.grammar = grammar
+        self.samples = {**_default_samples, **(samples or {})}
+        self.bodies: T.DefaultDict[THead, T.List[T.List[str]]] = defaultdict(list)
+        for head, body in grammar.productions:
+            self.bodies[head].append(body.split())
+        for head, bodies in self.bodies.items():
+            for body in bodies:
+                for symbol in body:
+                    if not self.is_nonterminal(symbol) and symbol not in self.samples:
+                        raise KeyError(f"[WorkloadGenerator] no samples for terminal {symbol} ({head} -> {' '.join(body)})")
+        self._compute_min_tokens()
+        self._compute_recursive()
+        self.growing_bodies = {
+            head: [body for body in bodies if any(symbol in self.recursive for symbol in body)]
+            for head, bodies in self.bodies.items()
+        }
+
+    def is_nonterminal(self, symbol: str) -> bool:
+        return symbol in self.bodies
+
+    def _compute_min_tokens(self):
+        """Fixed point for the length of the shortest derivation of each symbol"""
+        self.min_tokens = {}
+        self.closing_production = {}
+        changed = True
+        while changed:
+            changed = False
+            for head, bodies in self.bodies.items():
+                for body in bodies:
+                    if all(not self.is_nonterminal(s) or s in self.min_tokens for s in body):
+                        length = sum(self.min_tokens[s] if self.is_nonterminal(s) else 1 for s in body)
+                        # NOTE: strict improvement only, so closing productions can't form a cycle
+                        if head not in self.min_tokens or length < self.min_tokens[head]:
+                            self.min_tokens[head] = length
+                            self.closing_production[head] = body
+                            changed = True
+        unproductive = set(self.bodies) - set(self.min_tokens)
+        if unproductive:
+            raise ValueError(f"[WorkloadGenerator] nonterminals derive no sentence: {sorted(unproductive)}")
+
+    def _compute_recursive(self):
+        """Nonterminals that can (transitively) derive themselves"""
+        reachable = {head: {s for body in bodies for s in body if self.is_nonterminal(s)} for head, bodies in self.bodies.items()}
+        changed = True
+        while changed:
+            changed = False
+            for head, symbols in reachable.items():
+                extended = symbols.union(*[reachable[s] for s in symbols])
+                if extended != symbols:
+                    reachable[head] = extended
+                    changed = True
+        self.recursive = {head for head, symbols in reachable.items() if head in symbols}
+
+    def _cost(self, symbol: str) -> int:
+        return self.min_tokens[symbol] if self.is_nonterminal(symbol) else 1
+
+    def generate_tokens(
+        self,
+        target_tokens: T.Optional[int] = None,
+        max_depth: T.Optional[int] = None,
+        seed: T.Optional[int] = None,
+        start_symbol: T.Optional[THead] = None,
+    ) -> T.List[str]:
+        if target_tokens is None and max_depth is None:
+            max_depth = 10
+        rng = random.Random(seed)
+        start = self.grammar.start_symbol if start_symbol is None else start_symbol
+        tokens: T.List[str] = []
+        # NOTE: iterative, generated sentences are far deeper than the recursion limit
+        stack: T.List[T.Tuple[str, int]] = [(start, 0)]
+        pending_cost = self._cost(start)
+        pending_recursive = 1 if start in self.recursive else 0
+
+        while stack:
+            symbol, depth = stack.pop()
+            pending_cost -= self._cost(symbol)
+            if not self.is_nonterminal(symbol):
+                tokens.append(rng.choice(self.samples[symbol]))
+                continue
+            if symbol in self.recursive:
+                pending_recursive -= 1
+
+            under_budget = target_tokens is None or len(tokens) + pending_cost + self.min_tokens[symbol] < target_tokens
+            if not under_budget or (max_depth is not None and depth >= max_depth):
+                body = self.closing_production[symbol]
+            elif pending_recursive == 0 and self.growing_bodies[symbol] and target_tokens is not None:
+                body = rng.choice(self.growing_bodies[symbol])
+            else:
+                body = rng.choice(self.bodies[symbol])
+
+            for child in reversed(body):
+                stack.append((child, depth + 1))
+                pending_cost += self._cost(child)
+                if child in self.recursive:
+                    pending_recursive += 1
+        return tokens
+
+    def generate(
+        self,
+        target_tokens: T.Optional[int] = None,
+        max_depth: T.Optional[int] = None,
+        seed: T.Optional[int] = None,
+        start_symbol: T.Optional[THead] = None,
+    ) -> str:
+        return " ".join(self.generate_tokens(target_tokens, max_depth, seed, start_symbol))
+
+
+def generate_sentence(
+    grammar: Grammar,
+    target_tokens: T.Optional[int] = None,
+    max_depth: T.Optional[int] = None,
+    seed: T.Optional[int] = None,
+) -> str:
+    return WorkloadGenerator(grammar).generate(target_tokens=target_tokens, max_depth=max_depth, seed=seed)
+
+
+if __name__ == "__main__":
+    from grammars import expression_grammar, fp_language_grammar
+    from regex_lexer import RegexLexer
+
+    for grammar in (expression_grammar, fp_language_grammar):
+        lexer = RegexLexer(grammar.terminals)
+        for target in (10, 100, 1000):
+            sentence = generate_sentence(grammar, target_tokens=target, seed=0)
+            lexemes = list(lexer(sentence))
+            print(f"{grammar.name} [target {target}, got {len(lexemes)}]: {sentence[:80]}")
+        print(f"{grammar.name} [max_depth 6]: {generate_sentence(grammar, max_depth=6, seed=1)}")